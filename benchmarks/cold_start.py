@@ -0,0 +1,94 @@
+"""Cold-start regression check: fresh interpreter -> import main -> startup -> first response.
+
+Run from the repository root:
+
+    python benchmarks/cold_start.py [--runs 5] [--budget-ms 1500] [--profile]
+
+Exits non-zero when the median cold start is over budget (COLD_START_BUDGET_MS
+or --budget-ms). --profile also prints the slowest top-level imports.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs in the child interpreter; no database is touched
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def first_request():
+    import httpx
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cold") as http:
+            response = await http.get("/metrics")
+            assert response.status_code == 200, response.status_code
+        return ready, time.perf_counter()
+
+ready, responded = asyncio.run(first_request())
+print(json.dumps({"import_ms": (imported - started) * 1000, "startup_ms": (ready - imported) * 1000,
+                  "first_response_ms": (responded - ready) * 1000}))
+"""
+
+
+def run_once() -> dict:
+    env = {
+        **os.environ,
+        "SECRET_KEY": os.getenv("SECRET_KEY", "cold-start"),
+        "MONGODB_URL": os.getenv("MONGODB_URL", "mongodb://localhost:27017"),
+        "ENSURE_INDEXES_ON_STARTUP": "0",
+        "TOKEN_REVOCATION_MONGO": "0",
+        "CHANGE_STREAMS": "0",
+        "MEDICINE_INDEX_ON_STARTUP": "0",
+        "MONGO_WARMUP": "0",
+        "STARTUP_PROFILE": "0",
+        # Keep log lines from landing after the JSON result on stdout
+        "LOG_LEVEL": "WARNING",
+    }
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True)
+    total_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        sys.exit(f"Cold start run failed:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["total_ms"] = total_ms
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("COLD_START_BUDGET_MS", "1500")))
+    parser.add_argument("--profile", action="store_true", help="print the import-time breakdown")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    medians = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    for key, value in medians.items():
+        print(f"{key:<18} {value:8.1f}ms (median of {args.runs})")
+
+    if args.profile:
+        from utils.profiling import import_breakdown
+        breakdown = import_breakdown("main")
+        print("Slowest top-level imports:")
+        for row in breakdown["top_level"][:15]:
+            print(f"  {row['module']:<40} {row['cumulative_ms']:8.1f}ms")
+
+    if medians["total_ms"] > args.budget_ms:
+        print(f"Cold start {medians['total_ms']:.0f}ms is over the {args.budget_ms:.0f}ms budget")
+        sys.exit(1)
+    print(f"Cold start within the {args.budget_ms:.0f}ms budget")
+
+
+if __name__ == "__main__":
+    main()
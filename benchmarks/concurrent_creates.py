@@ -0,0 +1,74 @@
+"""Fire parallel duplicate creates and check that exactly one of each succeeds.
+
+Run from the repository root:
+
+    python benchmarks/concurrent_creates.py [--mongo-url mongodb://localhost:27017] [--parallel 20]
+
+Without --mongo-url the in-memory fake is used; it serializes writes, so
+only a real mongod exercises the race between concurrent inserts.
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+from load_test import configure_backend
+
+
+async def fire(http, parallel: int, method: str, path: str, body: dict, headers: dict = None) -> Counter:
+    responses = await asyncio.gather(*(http.request(method, path, json=body, headers=headers) for _ in range(parallel)))
+    return Counter(response.status_code for response in responses)
+
+
+def succeeded_once(statuses: Counter) -> bool:
+    """One 201, the rest rejected as duplicates (or shed by the bcrypt queue with 503)"""
+    return statuses[201] == 1 and statuses[400] + statuses[503] == sum(statuses.values()) - 1
+
+
+async def main_async(parallel: int) -> bool:
+    import httpx
+    from main import app
+    from mongodb.connection import doctor_collection, ensure_indexes, patient_collection
+    from utils.jwt import create_access_token
+
+    await doctor_collection.delete_many({})
+    await patient_collection.delete_many({})
+    report = await ensure_indexes()
+    if report["failed"]:
+        print(f"Could not build indexes: {report['failed']}")
+        return False
+
+    ok = True
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://race") as http:
+            doctor = {"username": "racedoctor", "email": "racedoctor@gmail.com", "password": "racepass1"}
+            statuses = await fire(http, parallel, "POST", "/doctor/register", doctor)
+            print(f"POST /doctor/register x{parallel}: {dict(statuses)}")
+            ok &= succeeded_once(statuses)
+
+            doctor_id = str((await doctor_collection.find_one({"email": doctor["email"]}))["_id"])
+            headers = {"Authorization": f"Bearer {create_access_token({'doctor_id': doctor_id})}"}
+            patient = {"username": "racepatient", "email": "racepatient@gmail.com", "PhoneNumber": "03001234567",
+                       "age": 30, "gender": "female", "weight": 60}
+            statuses = await fire(http, parallel, "POST", "/patient/create", patient, headers)
+            print(f"POST /patient/create x{parallel}: {dict(statuses)}")
+            ok &= succeeded_once(statuses)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="local mongod to use instead of the in-memory fake")
+    parser.add_argument("--parallel", type=int, default=20)
+    args = parser.parse_args()
+    configure_backend(args.mongo_url)
+
+    if not asyncio.run(main_async(args.parallel)):
+        print("FAILED: expected exactly one successful create per resource")
+        sys.exit(1)
+    print("OK: exactly one create succeeded per resource")
+
+
+if __name__ == "__main__":
+    main()
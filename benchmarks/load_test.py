@@ -0,0 +1,434 @@
+"""Load test every router of the app against a local MongoDB or an in-memory stand-in.
+
+Run from the repository root:
+
+    python benchmarks/load_test.py                      # in-memory fake (needs mongomock-motor)
+    python benchmarks/load_test.py --mongo-url mongodb://localhost:27017
+    python benchmarks/load_test.py --baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --save-baseline benchmarks/baseline.json
+
+Data is seeded straight into the collections (N doctors, M patients each, K
+prescriptions each), then every endpoint is driven by concurrent in-process
+clients. Per-route throughput and p50/p95/p99 latency are printed and written
+as JSON, along with the interpreter, platform and package versions measured on. With --baseline the run exits non-zero when a route regressed by more
+than --tolerance.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_DATABASE = "bench_doctor_Management"
+
+
+def configure_backend(mongo_url: Optional[str]):
+    """Point the connection manager at a local mongod or at mongomock"""
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    # Every simulated client shares one address and a handful of accounts
+    os.environ.setdefault("LOGIN_IP_PER_MINUTE", "1000000")
+    os.environ.setdefault("LOGIN_EMAIL_PER_MINUTE", "1000000")
+    # Keep per-request log lines out of the report
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Seeding wipes the collections, so never run against the application database
+    os.environ["MONGODB_DATABASE"] = BENCH_DATABASE
+    if mongo_url:
+        os.environ["MONGODB_URL"] = mongo_url
+        os.environ.setdefault("MONGODB_TLS", "0")
+        return "mongod"
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("The in-memory backend needs mongomock-motor (pip install mongomock-motor), "
+                 "or pass --mongo-url for a local mongod")
+    from mongodb.connection import manager
+
+    # The fake has no change streams
+    os.environ["CHANGE_STREAMS"] = "0"
+    manager.use_client(AsyncMongoMockClient())
+    return "fake"
+
+
+@dataclass
+class Context:
+    """Seeded ids and tokens shared by the scenarios"""
+    doctors: list = field(default_factory=list)            # (doctor_id, email, token)
+    patients: dict = field(default_factory=dict)           # doctor_id -> [patient_id]
+    prescriptions: dict = field(default_factory=dict)      # doctor_id -> [prescription_id]
+    deletable: dict = field(default_factory=dict)          # pool name -> [(doctor_id, token, doc_id)]
+    counter: itertools.count = field(default_factory=itertools.count)
+
+    def doctor(self, i: int):
+        return self.doctors[i % len(self.doctors)]
+
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[[Context, int], tuple]  # -> (method, path, json body, token)
+    weight: float = 1.0                     # fraction of --requests to send
+    fake_ok: bool = True                    # False when the in-memory fake lacks a feature
+    replay_keys: int = 0                    # send Idempotency-Key i % replay_keys, so most requests are replays
+    content_type: Optional[str] = None      # send the body as raw bytes of this type instead of JSON
+    stream: bool = False                    # time the first body chunk of an endless response, then disconnect
+
+
+def _patient_body(n: int) -> dict:
+    return {"username": f"benchpatient{n}", "email": f"benchpatient{n}@gmail.com", "PhoneNumber": "03001234567",
+            "age": 20 + n % 60, "gender": "female" if n % 2 else "male", "weight": 50 + n % 50}
+
+
+def _prescription_body(patient_id: str, n: int) -> dict:
+    return {"patient_id": patient_id, "symptoms": f"Fever and cough, visit {n}",
+            "medicines": [{"name": "Paracetamol", "dosage": "500mg", "frequency": "Twice a day", "duration": "5 days"}],
+            "notes": "Rest and fluids", "follow_up_days": 7}
+
+
+def _owned(ctx: Context, i: int, pool: str):
+    doctor_id, _, token = ctx.doctor(i)
+    ids = (ctx.patients if pool == "patients" else ctx.prescriptions)[doctor_id]
+    return doctor_id, token, ids[i % len(ids)]
+
+
+def _batch(ctx: Context, i: int, pool: str, size: int = 20):
+    doctor_id, _, token = ctx.doctor(i)
+    ids = (ctx.patients if pool == "patients" else ctx.prescriptions)[doctor_id]
+    return "POST", f"/{pool[:-1]}/batch", {"ids": [ids[(i + n) % len(ids)] for n in range(size)]}, token
+
+
+def _bulk(ctx: Context, i: int, pool: str, size: int = 50):
+    """NDJSON upload of size new records"""
+    doctor_id, _, token = ctx.doctor(i)
+    patient_id = ctx.patients[doctor_id][i % len(ctx.patients[doctor_id])]
+    records = (_patient_body(next(ctx.counter)) if pool == "patients" else _prescription_body(patient_id, n)
+               for n in range(size))
+    return "POST", f"/{pool[:-1]}/bulk", b"".join(json.dumps(record).encode() + b"\n" for record in records), token
+
+
+# Operational endpoints, requested in turn by one scenario
+STATS_PATHS = ["/stats/token-cache", "/stats/cache", "/stats/ownership", "/stats/events", "/stats/medicines",
+               "/stats/login-throttle", "/stats/idempotency", "/stats/logging"]
+
+
+def _pop(ctx: Context, pool: str):
+    return ctx.deletable[pool].pop()
+
+
+SCENARIOS = [
+    Scenario("POST /doctor/register", lambda ctx, i: (
+        "POST", "/doctor/register",
+        {"username": f"bd{next(ctx.counter)}", "email": f"benchdoc{next(ctx.counter)}@gmail.com", "password": "benchpass1"},
+        None), weight=0.1),
+    Scenario("POST /doctor/login", lambda ctx, i: (
+        "POST", "/doctor/login", {"email": ctx.doctor(i)[1], "password": "benchpass1"}, None), weight=0.1),
+    Scenario("POST /doctor/logout", lambda ctx, i: ("POST", "/doctor/logout", None, _pop(ctx, "sessions")[1])),
+    Scenario("POST /doctor/logout-all", lambda ctx, i: ("POST", "/doctor/logout-all", None, _pop(ctx, "signout")[1])),
+    Scenario("GET /doctor/all", lambda ctx, i: ("GET", "/doctor/all", None, None)),
+    Scenario("GET /doctor/me/stats", lambda ctx, i: ("GET", "/doctor/me/stats", None, ctx.doctor(i)[2])),
+    Scenario("GET /doctor/{doctor_id}", lambda ctx, i: ("GET", f"/doctor/{ctx.doctor(i)[0]}", None, None)),
+    Scenario("PUT /doctor/{doctor_id}", lambda ctx, i: (lambda d, t, email: (
+        "PUT", f"/doctor/{d}",
+        {"username": f"upd{next(ctx.counter)}", "email": email, "password": "benchpass1"}, t))(*ctx.deletable["editable"][0])),
+    Scenario("DELETE /doctor/{doctor_id}", lambda ctx, i: (lambda d, t, _: (
+        "DELETE", f"/doctor/{d}", None, t))(*_pop(ctx, "doctors"))),
+    Scenario("POST /patient/create", lambda ctx, i: (
+        "POST", "/patient/create", _patient_body(next(ctx.counter)), ctx.doctor(i)[2])),
+    Scenario("POST /patient/bulk", lambda ctx, i: _bulk(ctx, i, "patients"), weight=0.1,
+             content_type="application/x-ndjson"),
+    Scenario("GET /patient/all", lambda ctx, i: ("GET", "/patient/all", None, ctx.doctor(i)[2])),
+    Scenario("POST /patient/batch", lambda ctx, i: _batch(ctx, i, "patients")),
+    Scenario("GET /patient/{patient_id}", lambda ctx, i: (lambda d, t, p: (
+        "GET", f"/patient/{p}", None, t))(*_owned(ctx, i, "patients"))),
+    Scenario("GET /patient/{patient_id}/history", lambda ctx, i: (lambda d, t, p: (
+        "GET", f"/patient/{p}/history", None, t))(*_owned(ctx, i, "patients")), fake_ok=False),
+    Scenario("PUT /patient/{patient_id}", lambda ctx, i: (lambda d, t, p: (
+        "PUT", f"/patient/{p}", _patient_body(next(ctx.counter)), t))(*_owned(ctx, i, "patients"))),
+    Scenario("DELETE /patient/{patient_id}", lambda ctx, i: (lambda d, t, p: (
+        "DELETE", f"/patient/{p}", None, t))(*_pop(ctx, "patients"))),
+    Scenario("POST /prescription/create", lambda ctx, i: (lambda d, t, p: (
+        "POST", "/prescription/create", _prescription_body(p, i), t))(*_owned(ctx, i, "patients"))),
+    Scenario("POST /prescription/create (replayed)", lambda ctx, i: (lambda d, t, p: (
+        "POST", "/prescription/create", _prescription_body(p, 0), t))(*_owned(ctx, i % 10, "patients")), replay_keys=10),
+    Scenario("POST /prescription/bulk", lambda ctx, i: _bulk(ctx, i, "prescriptions"), weight=0.1,
+             content_type="application/x-ndjson"),
+    Scenario("GET /prescription/all", lambda ctx, i: ("GET", "/prescription/all", None, ctx.doctor(i)[2])),
+    Scenario("GET /prescription/medicines/suggest", lambda ctx, i: (
+        "GET", "/prescription/medicines/suggest?q=p", None, ctx.doctor(i)[2])),
+    Scenario("GET /prescription/follow-ups", lambda ctx, i: (
+        "GET", "/prescription/follow-ups?from=0&to=4102444800", None, ctx.doctor(i)[2])),
+    Scenario("GET /prescription/export?format=jsonl", lambda ctx, i: (
+        "GET", "/prescription/export?format=jsonl", None, ctx.doctor(i)[2]), weight=0.2),
+    Scenario("GET /prescription/export?format=csv", lambda ctx, i: (
+        "GET", "/prescription/export?format=csv", None, ctx.doctor(i)[2]), weight=0.2),
+    Scenario("POST /prescription/batch", lambda ctx, i: _batch(ctx, i, "prescriptions")),
+    Scenario("GET /prescription/{prescription_id}", lambda ctx, i: (lambda d, t, p: (
+        "GET", f"/prescription/{p}", None, t))(*_owned(ctx, i, "prescriptions"))),
+    Scenario("PUT /prescription/{prescription_id}", lambda ctx, i: (lambda d, t, p: (
+        "PUT", f"/prescription/{p}",
+        {"symptoms": f"Updated symptoms {next(ctx.counter)}", "medicines": _prescription_body("", i)["medicines"],
+         "notes": "Updated", "follow_up_days": 14}, t))(*_owned(ctx, i, "prescriptions"))),
+    Scenario("DELETE /prescription/{prescription_id}", lambda ctx, i: (lambda d, t, p: (
+        "DELETE", f"/prescription/{p}", None, t))(*_pop(ctx, "prescriptions"))),
+    Scenario("GET /events (first frame)", lambda ctx, i: ("GET", "/events", None, ctx.doctor(i)[2]), stream=True),
+    Scenario("GET /stats/*", lambda ctx, i: ("GET", STATS_PATHS[i % len(STATS_PATHS)], None, None)),
+    Scenario("GET /health", lambda ctx, i: ("GET", "/health", None, None)),
+    Scenario("GET /metrics", lambda ctx, i: ("GET", "/metrics", None, None)),
+]
+
+
+async def seed(doctors: int, patients: int, prescriptions: int, requests: int) -> Context:
+    """Insert the benchmark data set directly, bypassing the API"""
+    from bson import ObjectId
+    from mongodb.connection import doctor_collection, patient_collection, prescription_collection
+    from utils.hash_password import hash_password
+    from utils.jwt import create_access_token
+
+    await doctor_collection.delete_many({})
+    await patient_collection.delete_many({})
+    await prescription_collection.delete_many({})
+
+    ctx = Context()
+    password_hash = hash_password("benchpass1")
+    now = int(time.time())
+
+    def new_doctor(label: str):
+        doctor_id = ObjectId()
+        doc = {"_id": doctor_id, "username": f"{label}{doctor_id}"[-20:], "email": f"{label}{doctor_id}@gmail.com",
+               "password": password_hash, "created_at": now, "updated_at": now}
+        return doc, str(doctor_id), create_access_token({"doctor_id": str(doctor_id)})
+
+    doctor_docs, patient_docs, prescription_docs = [], [], []
+    for d in range(doctors):
+        doc, doctor_id, token = new_doctor("seed")
+        doctor_docs.append(doc)
+        ctx.doctors.append((doctor_id, doc["email"], token))
+        ctx.patients[doctor_id], ctx.prescriptions[doctor_id] = [], []
+        for p in range(patients):
+            patient_id = ObjectId()
+            n = d * patients + p
+            patient_docs.append({"_id": patient_id, "doctor_id": doctor_id, **_patient_body(n), "created_at": now + n, "updated_at": now + n})
+            ctx.patients[doctor_id].append(str(patient_id))
+            for r in range(prescriptions):
+                prescription_id = ObjectId()
+                body = _prescription_body(str(patient_id), r)
+                prescription_docs.append({"_id": prescription_id, "doctor_id": doctor_id, **body,
+                                          "created_at": now + r, "updated_at": now + r})
+                ctx.prescriptions[doctor_id].append(str(prescription_id))
+
+    # Throwaway documents and sessions for the destructive scenarios
+    ctx.deletable = {"doctors": [], "signout": [], "editable": [], "patients": [], "prescriptions": [], "sessions": []}
+    for pool in ("doctors", "signout", "editable"):
+        for _ in range(requests if pool != "editable" else 1):
+            doc, doctor_id, token = new_doctor(pool[:4])
+            doctor_docs.append(doc)
+            ctx.deletable[pool].append((doctor_id, token, doc["email"]))
+    for i in range(requests):
+        doctor_id, _, token = ctx.doctor(i)
+        patient_id, prescription_id = ObjectId(), ObjectId()
+        patient_docs.append({"_id": patient_id, "doctor_id": doctor_id, **_patient_body(10**7 + i), "created_at": now, "updated_at": now})
+        prescription_docs.append({"_id": prescription_id, "doctor_id": doctor_id, **_prescription_body(str(patient_id), i),
+                                  "created_at": now, "updated_at": now})
+        ctx.deletable["patients"].append((doctor_id, token, str(patient_id)))
+        ctx.deletable["prescriptions"].append((doctor_id, token, str(prescription_id)))
+        ctx.deletable["sessions"].append((doctor_id, create_access_token({"doctor_id": doctor_id}), None))
+
+    for collection, docs in ((doctor_collection, doctor_docs), (patient_collection, patient_docs),
+                             (prescription_collection, prescription_docs)):
+        for start in range(0, len(docs), 1000):
+            await collection.insert_many(docs[start:start + 1000])
+    ctx.counter = itertools.count(10**8)
+    return ctx
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+async def first_chunk(app, method: str, path: str, headers: dict) -> int:
+    """Call the ASGI app until the first non-empty body chunk, then disconnect; returns the status.
+
+    httpx's ASGITransport buffers the whole body, which never ends for an event stream.
+    """
+    disconnected = asyncio.Event()
+    status_code = 0
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+             "client": ("127.0.0.1", 50000), "server": ("bench", 80)}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body" and (message.get("body") or not message.get("more_body")):
+            disconnected.set()
+
+    await app(scope, receive, send)
+    return status_code
+
+
+async def run_scenario(http, app, ctx: Context, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in indexes:
+            method, path, body, token = scenario.build(ctx, i)
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            if scenario.replay_keys:
+                headers["Idempotency-Key"] = f"bench-{i % scenario.replay_keys}"
+            started = time.perf_counter()
+            if scenario.stream:
+                status_code = await first_chunk(app, method, path, headers)
+            else:
+                if scenario.content_type:
+                    headers["Content-Type"] = scenario.content_type
+                    response = await http.request(method, path, content=body, headers=headers)
+                else:
+                    response = await http.request(method, path, json=body, headers=headers)
+                await response.aread()
+                status_code = response.status_code
+            latencies.append(time.perf_counter() - started)
+            if status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def environment() -> dict:
+    """Where a run was measured, so a baseline is only compared against like"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    packages = {}
+    for name in ("fastapi", "starlette", "pydantic", "motor", "pymongo", "mongomock-motor", "orjson", "httpx"):
+        try:
+            packages[name] = version(name)
+        except PackageNotFoundError:
+            pass
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "commit": commit, "packages": packages}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose p95 grew or throughput dropped by more than the tolerance"""
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if not previous:
+            print(f"{route}: not in baseline")
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {previous['throughput_rps']:.0f} -> {current['throughput_rps']:.0f} req/s")
+    return regressions
+
+
+async def main_async(args) -> dict:
+    import httpx
+    from main import app
+
+    requests = args.requests
+    ctx = await seed(args.doctors, args.patients, args.prescriptions, requests)
+    routes = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            for scenario in SCENARIOS:
+                if args.only and args.only not in scenario.name:
+                    continue
+                if args.backend == "fake" and not scenario.fake_ok:
+                    print(f"{scenario.name:<40} skipped (not supported by the in-memory fake)")
+                    continue
+                count = max(1, int(requests * scenario.weight))
+                result = await run_scenario(http, app, ctx, scenario, count, args.concurrency)
+                routes[scenario.name] = result
+                print(f"{scenario.name:<40} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:7.2f}ms  "
+                      f"p95 {result['p95_ms']:7.2f}ms  p99 {result['p99_ms']:7.2f}ms  errors {result['errors']}")
+    return {
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "environment": environment(),
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "dataset": {"doctors": args.doctors, "patients": args.patients, "prescriptions": args.prescriptions},
+        "requests": requests,
+        "concurrency": args.concurrency,
+        "routes": routes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="local mongod to use instead of the in-memory fake")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=50, help="patients per doctor")
+    parser.add_argument("--prescriptions", type=int, default=5, help="prescriptions per patient")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--only", help="run only routes whose name contains this text")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this path")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+    args.backend = configure_backend(args.mongo_url)
+
+    results = asyncio.run(main_async(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
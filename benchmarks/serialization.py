@@ -0,0 +1,93 @@
+"""Per-document cost of serializing list responses, before and after the read-side path.
+
+Run from the repository root:
+
+    python benchmarks/serialization.py [--docs 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from model.patient import PatientResponse
+from model.prescription import PrescriptionResponse
+import utils.serialization as serialization
+
+
+def make_patients(n):
+    return [{
+        "_id": ObjectId(), "doctor_id": str(ObjectId()), "username": f"patient{i}",
+        "email": f"patient{i}@gmail.com", "PhoneNumber": "03001234567", "age": 30 + i % 50,
+        "gender": "female" if i % 2 else "male", "weight": 60 + i % 40,
+        "created_at": 1700000000 + i, "updated_at": 1700000000 + i,
+    } for i in range(n)]
+
+
+def make_prescriptions(n):
+    return [{
+        "_id": ObjectId(), "doctor_id": str(ObjectId()), "patient_id": str(ObjectId()),
+        "symptoms": "Fever and headache for three days",
+        "medicines": [{"name": "Paracetamol", "dosage": "500mg", "frequency": "Twice a day", "duration": "5 days"},
+                      {"name": "Ibuprofen", "dosage": "200mg", "frequency": "Once a day", "duration": "3 days"}],
+        "notes": "Drink plenty of water", "follow_up_days": 7,
+        "created_at": 1700000000 + i, "updated_at": 1700000000 + i,
+    } for i in range(n)]
+
+
+def legacy_path(docs, model):
+    """Model per document, then FastAPI's response_model validation and jsonable_encoder"""
+    adapter = serialization.list_adapter(model)
+    instances = [model(**d) for d in docs]
+    validated = adapter.validate_python([m.model_dump() for m in instances])
+    return json.dumps(jsonable_encoder(adapter.dump_python(validated, mode="json"))).encode()
+
+
+def batch_validated_path(docs, model):
+    serialization.TRUST_DB_READS = False
+    return serialization.json_response(serialization.serialize_documents(docs, model)).body
+
+
+def trusted_path(docs, model):
+    serialization.TRUST_DB_READS = True
+    return serialization.json_response(serialization.serialize_documents(docs, model)).body
+
+
+def gzip_path(docs, model):
+    serialization.TRUST_DB_READS = True
+    return serialization.json_response(serialization.serialize_documents(docs, model), "gzip").body
+
+
+def measure(fn, docs, model, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(docs, model)
+        best = min(best, time.perf_counter() - started)
+    return best, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for label, model, docs in (("patient", PatientResponse, make_patients(args.docs)),
+                               ("prescription", PrescriptionResponse, make_prescriptions(args.docs))):
+        print(f"{label}: {args.docs} documents, best of {args.repeat}")
+        baseline = None
+        for name, fn in (("legacy", legacy_path), ("batch-validated", batch_validated_path),
+                         ("trusted", trusted_path), ("trusted+gzip", gzip_path)):
+            seconds, size = measure(fn, docs, model, args.repeat)
+            baseline = baseline or seconds
+            print(f"  {name:<16} {seconds * 1e6 / args.docs:8.2f} us/doc  {size / 1024:9.1f} KiB  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
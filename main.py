@@ -1,25 +1,70 @@
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from mongodb.connection import doctor_collection
-from mongodb.connection import client
+from fastapi.responses import JSONResponse, PlainTextResponse
+from mongodb.change_stream import CHANGE_STREAMS, change_feed
+from mongodb.connection import MONGO_WARMUP, ensure_indexes, explain_query_shapes, manager, start_index_build
 from routes.doctor import router as doctor_router
 from routes.patient import router as patient_router
 from routes.prescription import router as prescription_router
+from routes.events import router as events_router
 from fastapi.middleware.cors import CORSMiddleware
+from utils.log import RequestIdMiddleware, configure_logging, log_stats
+from utils.cache import document_cache
+from utils.events import event_hub
+from utils.idempotency import idempotency_store
+from utils.medicine_index import MEDICINE_INDEX_ON_STARTUP, medicine_index, medicine_index_loop
+from utils.ownership import ownership_index
+from utils.metrics import MetricsMiddleware, render_metrics
+from utils.profiling import STARTUP_PROFILE, write_startup_profile
+from utils.throttle import login_throttle
+from utils.token_cache import TOKEN_REVOCATION_MONGO, revocation_sync_loop, token_cache
+
+# Serverless deployments can build indexes at deploy time instead
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "1") == "1"
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background work on startup and release the Mongo client on shutdown"""
+    startup_started = time.perf_counter()
+    background = []
+    if MONGO_WARMUP:
+        logger.info("MongoDB warm-up ping", extra={"ping_ms": round(await manager.warm_up(), 1)})
+    if os.getenv("MONGO_EXPLAIN_CHECK") == "1":
+        # Test mode: build indexes up front and refuse to start if any route query scans a collection
+        await ensure_indexes()
+        await explain_query_shapes()
+    elif ENSURE_INDEXES_ON_STARTUP:
+        background.append(start_index_build())
+    if TOKEN_REVOCATION_MONGO:
+        background.append(asyncio.create_task(revocation_sync_loop()))
+    if CHANGE_STREAMS != "0":
+        background.append(asyncio.create_task(change_feed.run()))
+    if MEDICINE_INDEX_ON_STARTUP:
+        background.append(asyncio.create_task(medicine_index_loop()))
+    if STARTUP_PROFILE:
+        write_startup_profile(app, {
+            "import_main": IMPORT_SECONDS * 1000,
+            "lifespan_startup": (time.perf_counter() - startup_started) * 1000,
+        })
 
-@app.on_event("startup")
-async def startup_db_client():
-    """Create database indexes on startup"""
-    # Create unique index on email
-    await doctor_collection.create_index("email", unique=True)
-    print("Database connected and indexes created!")
+    yield
 
+    for task in background:
+        task.cancel()
+    manager.close()
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    """Close database connection"""
-    client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 
 origins = [
@@ -32,9 +77,98 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers hide response headers from scripts unless they are listed here
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified", "X-Request-ID", "Idempotent-Replayed"],
 )
+# Latency covers every other middleware
+app.add_middleware(MetricsMiddleware)
+# Outermost, so every log line (including slow-request warnings) carries the request id
+app.add_middleware(RequestIdMiddleware)
 
 # Include routers
 app.include_router(doctor_router, prefix="/doctor")
 app.include_router(patient_router, prefix="/patient")
-app.include_router(prescription_router, prefix="/prescription")
\ No newline at end of file
+app.include_router(prescription_router, prefix="/prescription")
+app.include_router(events_router, prefix="/events")
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+@app.get("/stats/token-cache")
+async def token_cache_stats():
+    """Hit/miss counters for the verified-token cache"""
+    return token_cache.stats()
+
+
+@app.get("/stats/cache")
+async def document_cache_stats():
+    """Hit ratio and eviction counters for the single-document cache"""
+    return document_cache.stats()
+
+
+@app.get("/stats/ownership")
+async def ownership_index_stats():
+    """Size and hit counters for the patient-ownership index"""
+    return {**ownership_index.stats(), "change_feed": change_feed.stats()}
+
+
+@app.get("/stats/events")
+async def event_stream_stats():
+    """Open event streams and publish counters"""
+    return event_hub.stats()
+
+
+@app.get("/stats/medicines")
+async def medicine_index_stats():
+    """Size and last rebuild of the medicine autocomplete index"""
+    return medicine_index.stats()
+
+
+@app.get("/stats/login-throttle")
+async def login_throttle_stats():
+    """Allowed and throttled login attempts, for tuning the limits"""
+    return login_throttle.stats()
+
+
+@app.get("/stats/idempotency")
+async def idempotency_stats():
+    """Executed, replayed (from this worker or Mongo), merged and conflicting Idempotency-Key requests"""
+    return idempotency_store.stats()
+
+
+@app.get("/stats/logging")
+async def logging_stats():
+    """Records waiting for the log writer thread and records dropped because its queue was full"""
+    return log_stats()
+
+
+@app.get("/health")
+async def health():
+    """Liveness plus Mongo reachability and connection pool stats"""
+    mongo = {}
+    try:
+        mongo["ping_ms"] = round(await manager.warm_up(), 2)
+        mongo["status"] = "ok"
+    except Exception as e:
+        mongo["status"] = "unreachable"
+        mongo["error"] = str(e)
+    mongo["pool"] = manager.pool_stats()
+    status = "ok" if mongo["status"] == "ok" else "degraded"
+    return JSONResponse({"status": status, "mongo": mongo}, status_code=200 if status == "ok" else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    token_stats = token_cache.stats()
+    cache_stats = document_cache.stats()
+    extra = {f"token_cache_{k}": v for k, v in token_stats.items()}
+    extra.update({f"document_cache_{k}": cache_stats[k] for k in ("size", "evictions", "expirations")})
+    extra.update({f"login_throttle_{k}": v for k, v in login_throttle.stats().items() if k != "backend"})
+    extra.update({f"event_hub_{k}": v for k, v in event_hub.stats().items() if k != "source"})
+    extra.update({f"ownership_index_{k}": v for k, v in ownership_index.stats().items() if k != "change_stream"})
+    extra.update({f"idempotency_{k}": v for k, v in idempotency_store.stats().items()})
+    extra.update({f"log_{k}": v for k, v in log_stats().items()})
+    for collection, values in cache_stats["collections"].items():
+        extra.update({f"document_cache_{collection}_{k}": v for k, v in values.items()})
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+from typing import List
+
+BATCH_MAX_IDS = 500
+
+
+class BatchIds(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
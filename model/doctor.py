@@ -46,7 +46,8 @@ class DoctorLogin(BaseModel):
     email: str
     password: str
 
-class DoctorResponse(CreateDoctor):
+# Read model: never carries the password hash, so responses, cached bodies and ?fields= cannot expose it
+class DoctorResponse(BaseModel):
     username: str
     email: EmailStr
     created_at: int
@@ -39,5 +39,6 @@ class PrescriptionResponse(CreatePrescription):
     medicines: list[Medicine]
     notes: Optional[str]
     follow_up_days: Optional[int]
+    follow_up_due_at: Optional[int] = None
     created_at: int
     updated_at: int
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""One-time backfill of prescription.follow_up_due_at for documents written before it existed.
+
+Run from the repository root:
+
+    python -m mongodb.backfill
+
+Safe to run again: only documents without the field are touched.
+"""
+import asyncio
+
+from mongodb.connection import manager, prescription_collection
+from utils.timerange import DAY_SECONDS
+
+
+async def backfill_follow_up_due_at() -> int:
+    """Set follow_up_due_at = created_at + follow_up_days days, server side, in one update_many"""
+    result = await prescription_collection.update_many(
+        {"follow_up_due_at": {"$exists": False}},
+        [{"$set": {"follow_up_due_at": {"$cond": [
+            {"$gt": ["$follow_up_days", 0]},
+            {"$add": ["$created_at", {"$multiply": ["$follow_up_days", DAY_SECONDS]}]},
+            None,
+        ]}, "rev": {"$add": [{"$ifNull": ["$rev", 0]}, 1]}}}]
+    )
+    return result.modified_count
+
+
+async def main():
+    try:
+        print(f"follow_up_due_at set on {await backfill_follow_up_due_at()} prescriptions")
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
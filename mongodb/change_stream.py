@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Optional
+
+
+from mongodb.connection import manager
+
+logger = logging.getLogger(__name__)
+
+# "auto" watches when the deployment supports change streams (replica sets, sharded clusters), "0" never does
+CHANGE_STREAMS = os.getenv("CHANGE_STREAMS", "auto")
+CHANGE_STREAM_RETRY_SECONDS = int(os.getenv("CHANGE_STREAM_RETRY_SECONDS", "5"))
+# Enable changeStreamPreAndPostImages on the watched collections (MongoDB 6+), so delete
+# events carry the deleted document and with it the owning doctor. Where that fails,
+# deletes are published by the worker that made them instead.
+CHANGE_STREAM_PRE_IMAGES = os.getenv("CHANGE_STREAM_PRE_IMAGES", "1") == "1"
+WATCHED_COLLECTIONS = ["patient", "prescription"]
+
+# Standalone mongod rejects $changeStream with this code
+NOT_A_REPLICA_SET = 40573
+NAMESPACE_NOT_FOUND = 26
+# The resume token fell off the oplog; events in between are gone
+HISTORY_LOST = 286
+
+
+class ChangeFeed:
+    """Single database-level change stream fanned out to in-process subscribers"""
+
+    def __init__(self):
+        self._handlers: list[Callable[[dict], None]] = []
+        self._reset_handlers: list[Callable[[], None]] = []
+        # None until the first watch attempt, then whether events are flowing
+        self.available: Optional[bool] = None
+        # True once delete events are known to carry pre-images
+        self.pre_images = False
+        self.resume_token: Optional[dict] = None
+        self.events = 0
+        self.restarts = 0
+
+    def subscribe(self, handler: Callable[[dict], None], on_reset: Optional[Callable[[], None]] = None):
+        """handler gets every change event; on_reset runs when events may have been missed"""
+        self._handlers.append(handler)
+        if on_reset:
+            self._reset_handlers.append(on_reset)
+
+    def _dispatch(self, change: dict):
+        for handler in self._handlers:
+            try:
+                handler(change)
+            except Exception:
+                logger.exception("Change stream handler failed")
+
+    def _reset(self):
+        self.resume_token = None
+        for handler in self._reset_handlers:
+            handler()
+
+    def watch(self, resume_after: Optional[dict] = None):
+        """Open a change stream over the watched collections"""
+        options = {"full_document": "updateLookup", "resume_after": resume_after}
+        if self.pre_images:
+            options["full_document_before_change"] = "whenAvailable"
+        return manager.database.watch([{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}], **options)
+
+    async def enable_pre_images(self):
+        """Turn on changeStreamPreAndPostImages for the watched collections, creating them if needed"""
+        from pymongo.errors import OperationFailure
+
+        for name in WATCHED_COLLECTIONS:
+            try:
+                await manager.database.command("collMod", name, changeStreamPreAndPostImages={"enabled": True})
+            except OperationFailure as e:
+                if e.code != NAMESPACE_NOT_FOUND:
+                    raise
+                await manager.database.create_collection(name, changeStreamPreAndPostImages={"enabled": True})
+        self.pre_images = True
+
+    async def run(self):
+        from pymongo.errors import OperationFailure
+
+        if CHANGE_STREAM_PRE_IMAGES:
+            try:
+                await self.enable_pre_images()
+            except Exception as e:
+                logger.warning("Change stream pre-images unavailable; deletes are published by the worker that made them: %s", e)
+        while True:
+            try:
+                async with self.watch(self.resume_token) as stream:
+                    self.available = True
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        self.events += 1
+                        self._dispatch(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    logger.warning("Change streams need a replica set; falling back to per-worker updates")
+                    self.available = False
+                    self._reset()
+                    return
+                logger.warning("Change stream failed: %s", e)
+                if e.code == HISTORY_LOST:
+                    self._reset()
+            except Exception as e:
+                logger.warning("Change stream failed: %s", e)
+            self.available = False
+            self.restarts += 1
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def stats(self) -> dict:
+        return {"available": self.available, "pre_images": self.pre_images, "events": self.events, "restarts": self.restarts,
+                "subscribers": len(self._handlers)}
+
+
+change_feed = ChangeFeed()
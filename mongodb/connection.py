@@ -1,19 +1,232 @@
-import certifi
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import logging
+import time
+from typing import Optional
+from bson import ObjectId
 from dotenv import load_dotenv
+from utils.metrics import event_listeners, pool_connection_counts
 import os
 
+logger = logging.getLogger(__name__)
+
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
-DATABASE_NAME = "doctor_Management"
-# MongoDB connection
-client = AsyncIOMotorClient(MONGODB_URL, tls=True, tlsCAFile=certifi.where())
-database = client[DATABASE_NAME]
-doctor_collection = database["doctor"]
-patient_collection = database["patient"]
-prescription_collection = database["prescription"]
+DATABASE_NAME = os.getenv("MONGODB_DATABASE", "doctor_Management")
+MONGODB_TLS = os.getenv("MONGODB_TLS", "1") == "1"
+# Pool settings; serverless instances want a small pool that drops idle sockets quickly
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+# Ping the server during startup so the first request does not pay for the handshake
+MONGO_WARMUP = os.getenv("MONGO_WARMUP", "0") == "1"
+
+
+class ConnectionManager:
+    """Owns the Motor client, creating it on first use"""
+
+    def __init__(self):
+        self._client = None
+        self.created_at: Optional[float] = None
+
+    def pool_options(self) -> dict:
+        return {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Motor, and with it pymongo, is only imported once a request actually needs the database
+            from motor.motor_asyncio import AsyncIOMotorClient
+            tls_options = {"tls": MONGODB_TLS}
+            if MONGODB_TLS:
+                import certifi
+                tls_options["tlsCAFile"] = certifi.where()
+            self.use_client(AsyncIOMotorClient(
+                MONGODB_URL, **tls_options, **self.pool_options(),
+                event_listeners=event_listeners()
+            ))
+        return self._client
+
+    def use_client(self, client):
+        """Install an already built client (used by the benchmarks)"""
+        self._client = client
+        self.created_at = time.time()
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    @property
+    def database(self):
+        return self.client[DATABASE_NAME]
+
+    async def warm_up(self) -> float:
+        """Ping the server and return the round trip in milliseconds"""
+        started = time.perf_counter()
+        await self.client.admin.command("ping")
+        return (time.perf_counter() - started) * 1000
+
+    def pool_stats(self) -> dict:
+        return {"client_created": self.connected, **pool_connection_counts(), **self.pool_options()}
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+manager = ConnectionManager()
+
+
+class LazyCollection:
+    """Collection handle that resolves through the manager, so importing it does not connect"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(manager.database[self.name], attr)
+
+
+doctor_collection = LazyCollection("doctor")
+patient_collection = LazyCollection("patient")
+prescription_collection = LazyCollection("prescription")
+revoked_token_collection = LazyCollection("revoked_token")
+doctor_stats_collection = LazyCollection("doctor_stats")
+idempotency_collection = LazyCollection("idempotency")
+
+
+# Every index the routers rely on, per collection.
+# Keys are (field, direction) pairs; any other entry is passed to create_index.
+INDEXES = {
+    "doctor": [
+        {"keys": [("email", 1)], "unique": True},
+        {"keys": [("username", 1)], "unique": True},
+        {"keys": [("created_at", 1), ("_id", 1)]},
+    ],
+    "patient": [
+        {"keys": [("email", 1)], "unique": True},
+        {"keys": [("username", 1)], "unique": True},
+        {"keys": [("doctor_id", 1), ("created_at", 1), ("_id", 1)]},
+    ],
+    "prescription": [
+        {"keys": [("doctor_id", 1), ("created_at", 1), ("_id", 1)]},
+        {"keys": [("doctor_id", 1), ("patient_id", 1), ("created_at", -1), ("_id", -1)]},
+        {"keys": [("doctor_id", 1), ("follow_up_due_at", 1), ("_id", 1)]},
+    ],
+    "revoked_token": [
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "idempotency": [
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+}
+
+# Representative filter/sort for every query the routers issue, used by the explain check
+_ANY_ID = ObjectId()
+_KEYSET = {"$or": [{"created_at": {"$gt": 0}}, {"created_at": 0, "_id": {"$gt": _ANY_ID}}]}
+QUERY_SHAPES = [
+    ("doctor", {"email": "x"}, None),
+    ("doctor", {"_id": _ANY_ID}, None),
+    ("doctor", {}, [("created_at", 1), ("_id", 1)]),
+    ("doctor", _KEYSET, [("created_at", 1), ("_id", 1)]),
+    ("doctor_stats", {"_id": "x"}, None),
+    ("idempotency", {"_id": "x"}, None),
+    ("patient", {"_id": _ANY_ID, "doctor_id": "x"}, None),
+    ("patient", {"doctor_id": "x"}, [("created_at", 1), ("_id", 1)]),
+    ("patient", {"doctor_id": "x", **_KEYSET}, [("created_at", 1), ("_id", 1)]),
+    ("prescription", {"_id": _ANY_ID, "doctor_id": "x"}, None),
+    ("prescription", {"doctor_id": "x"}, [("created_at", 1), ("_id", 1)]),
+    ("prescription", {"doctor_id": "x", **_KEYSET}, [("created_at", 1), ("_id", 1)]),
+    ("prescription", {"doctor_id": "x", "patient_id": "x", "created_at": {"$gte": 0, "$lte": 1}},
+     [("created_at", -1), ("_id", -1)]),
+    ("prescription", {"doctor_id": "x", "created_at": {"$gte": 0, "$lte": 1}}, [("created_at", 1), ("_id", 1)]),
+    ("prescription", {"doctor_id": "x", "follow_up_due_at": {"$gte": 0, "$lte": 1}},
+     [("follow_up_due_at", 1), ("_id", 1)]),
+    ("prescription", {"doctor_id": "x", "patient_id": "x", "created_at": {"$gte": 0, "$lte": 1}},
+     [("created_at", 1), ("_id", 1)]),
+]
+
+
+def duplicate_key_field(error) -> str:
+    """Name of the field whose unique index rejected a write"""
+    details = error.details or {}
+    fields = list(details.get("keyPattern") or details.get("keyValue") or {})
+    if fields:
+        return fields[0]
+    message = str(error)
+    for field in ("email", "username"):
+        if f"{field}_1" in message:
+            return field
+    return "email or username"
+
+
+def index_name(keys) -> str:
+    """Default MongoDB name for an index on the given keys"""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+async def ensure_indexes() -> dict:
+    """Create missing registry indexes and report the ones that drifted"""
+    report = {"created": [], "drifted": [], "unexpected": [], "failed": []}
+    for collection_name, specs in INDEXES.items():
+        collection = manager.database[collection_name]
+        existing = await collection.index_information()
+        for spec in specs:
+            options = {k: v for k, v in spec.items() if k != "keys"}
+            name = index_name(spec["keys"])
+            current = existing.get(name)
+            if current is None:
+                try:
+                    await collection.create_index(spec["keys"], name=name, **options)
+                    report["created"].append(f"{collection_name}.{name}")
+                except Exception as e:
+                    report["failed"].append(f"{collection_name}.{name}: {e}")
+                continue
+            if list(current["key"]) != list(spec["keys"]) or any(current.get(k, False) != v for k, v in options.items()):
+                report["drifted"].append(f"{collection_name}.{name}")
+        expected = {index_name(spec["keys"]) for spec in specs} | {"_id_"}
+        report["unexpected"].extend(f"{collection_name}.{name}" for name in existing if name not in expected)
+
+    for key in ("drifted", "unexpected", "failed"):
+        if report[key]:
+            logger.warning("Index %s: %s", key, ", ".join(report[key]))
+    return report
+
+
+def start_index_build() -> asyncio.Task:
+    """Run ensure_indexes in the background so startup does not wait on index builds"""
+    return asyncio.get_running_loop().create_task(ensure_indexes())
+
 
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
 
 
+async def explain_query_shapes():
+    """Explain every registered query shape and fail if any of them scans a whole collection"""
+    offenders = []
+    for collection_name, query, sort in QUERY_SHAPES:
+        cursor = manager.database[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        winning_plan = explanation["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            offenders.append(f"{collection_name} {query} sort={sort}")
+    if offenders:
+        raise RuntimeError("Queries without index support: " + "; ".join(offenders))
@@ -1,38 +1,41 @@
-from fastapi import APIRouter, HTTPException,status, Depends
-from mongodb.connection import client, doctor_collection
+from fastapi import APIRouter, HTTPException,status, Depends, Header, Query, Request
+from mongodb.connection import doctor_collection, doctor_stats_collection, duplicate_key_field
 from bson import ObjectId
 from model.doctor import CreateDoctor, DoctorLogin, DoctorResponse, DoctorUpdate
 from utils.jwt import create_access_token
-from utils.hash_password import hash_password, verify_password
-from utils.dependency import get_current_doctor
+from utils.hash_password import hash_password_async, verify_password_async
+from utils.idempotency import idempotency_store
+from utils.dependency import get_current_claims, get_current_doctor, security
+from utils.token_cache import revoke, revoke_all_for_doctor
+from utils.throttle import client_ip, login_throttle
+from fastapi.security import HTTPAuthorizationCredentials
+from utils.doctor_stats import STATS_MAX_DAYS, read_stats
+from utils.cache import cache_entry, document_cache
+from utils.fields import parse_fields, partial_model, projection, select
+from utils.conditional import check_document, document_headers
+from utils.serialization import json_response, serialize_document
+from utils.pagination import MAX_PAGE_LIMIT, list_response
 from datetime import datetime
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 @router.post("/register", response_model=dict, status_code=status.HTTP_201_CREATED)
-async def register_doctor(doctor:CreateDoctor):
-    print("Login attempt for:", credentials.email)
-    print("Doctor found:", bool(doctor))
-    print("Password hash:", doctor.get("password"))
+async def register_doctor(doctor:CreateDoctor, idempotency_key: Optional[str] = Header(None)):
+    # A retry with the same Idempotency-Key gets the first response back, without hashing the password again
+    return await idempotency_store.run(idempotency_key, "doctor.register", None, doctor,
+                                       lambda: _register_doctor(doctor))
 
-    try:
-        # Check if user already exists
-        existing_doctor = await doctor_collection.find_one({
-            "$or": [
-                {"email": doctor.email.lower()},
-                {"username": doctor.username.lower()}
-            ]
-        })
-        print(f"Existing doctor found: {existing_doctor}")
-        if existing_doctor:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="User with this email or username already exists"
-            )
 
+async def _register_doctor(doctor: CreateDoctor) -> dict:
+    from pymongo.errors import DuplicateKeyError
 
-        hashed_password = hash_password(doctor.password)
+    try:
+        hashed_password = await hash_password_async(doctor.password)
 
         # Create user document
         current_time = int(datetime.now().timestamp())
@@ -41,10 +44,17 @@ async def register_doctor(doctor:CreateDoctor):
             "email": doctor.email.lower(),
             "password": hashed_password,  # Stored as hash
             "created_at": current_time,
-            "updated_at": current_time
+            "updated_at": current_time,
+            "rev": 1
         }
-        # Insert into database
-        result = await doctor_collection.insert_one(doctor_dict)
+        # Insert into database; unique indexes on email and username reject duplicates
+        try:
+            result = await doctor_collection.insert_one(doctor_dict)
+        except DuplicateKeyError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"User with this {duplicate_key_field(e)} already exists"
+            )
 
         return {
             "message": "User registered successfully",
@@ -53,8 +63,8 @@ async def register_doctor(doctor:CreateDoctor):
         }
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error during registration: {e}")
+    except Exception:
+        logger.exception("Doctor registration failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Registration failed"
@@ -62,27 +72,38 @@ async def register_doctor(doctor:CreateDoctor):
 
 
 @router.post("/login", response_model=dict)
-async def login_doctor(credentials: DoctorLogin):
+async def login_doctor(credentials: DoctorLogin, request: Request):
     """Authenticate doctor and return access token"""
+    email, ip = credentials.email.lower(), client_ip(request)
+    # Over-limit attempts stop here, before the lookup and bcrypt
+    await login_throttle.check(email, ip)
     try:
-        print(f"Login attempt for email: {credentials.email}")
+        logger.info("Login attempt", extra={"email": email})
 
         # Find doctor by email
         doctor = await doctor_collection.find_one({"email": credentials.email.lower()})
-        print(f"User found: {doctor is not None}")
+        logger.debug("Login lookup", extra={"email": email, "found": doctor is not None})
         if not doctor:
+            await login_throttle.failed(email, ip)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
 
         # Verify password
-        if not verify_password(credentials.password, doctor.get("password")):
+        valid, new_hash = await verify_password_async(credentials.password, doctor.get("password"))
+        if not valid:
+            await login_throttle.failed(email, ip)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
 
+        # Stored hash used a different bcrypt cost, replace it
+        if new_hash:
+            await doctor_collection.update_one({"_id": doctor["_id"]}, {"$set": {"password": new_hash}})
+
+        await login_throttle.succeeded(email, ip)
         token = create_access_token({"doctor_id": str(doctor["_id"])})
 
         # Ensure we return a proper dictionary response
@@ -91,50 +112,88 @@ async def login_doctor(credentials: DoctorLogin):
             "token": {"access_token": token, "token_type": "bearer"},
             "email": doctor["email"].lower(),
         }
-        print(f"Login successful, returning: {response_data}")
+        logger.info("Login succeeded", extra={"email": email, "doctor_id": str(doctor["_id"])})
 
 
         return response_data
 
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Login error: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Login failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Login failed"
         )
 
 
+@router.post("/logout", response_model=dict)
+async def logout_doctor(credentials: HTTPAuthorizationCredentials = Depends(security), claims: dict = Depends(get_current_claims)):
+    """Revoke the token used for this request"""
+    await revoke(credentials.credentials, claims)
+    return {"message": "Logged out successfully"}
+
+
+@router.post("/logout-all", response_model=dict)
+async def logout_all_sessions(doctor_id: str = Depends(get_current_doctor)):
+    """Revoke every token issued to the current doctor"""
+    await revoke_all_for_doctor(doctor_id)
+    return {"message": "All sessions signed out"}
+
+
 @router.get("/all", response_model=list[DoctorResponse])
-async def get_all_doctors():
-    doctors = await doctor_collection.find().to_list(100)
-    return [DoctorResponse(**doc) for doc in doctors]
+async def get_all_doctors(limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+        cursor: Optional[str] = None, fields: Optional[str] = None, accept: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
+    return await list_response(doctor_collection, {}, DoctorResponse, limit, cursor, fields, accept, accept_encoding,
+                               if_none_match)
+
+# Dashboard counters for the logged-in doctor
+@router.get("/me/stats", response_model=dict)
+async def get_my_stats(doctor_id: str = Depends(get_current_doctor), days: int = Query(30, ge=1, le=STATS_MAX_DAYS)):
+    return await read_stats(doctor_id, days)
 
 # Get doctor profile
 @router.get("/{doctor_id}", response_model=DoctorResponse)
-async def get_doctor(doctor_id: str):
-    doctor = await doctor_collection.find_one({"_id": ObjectId(doctor_id)})
+async def get_doctor(doctor_id: str, fields: Optional[str] = None, if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None)):
+    selected = parse_fields(fields, DoctorResponse)
+    cached = await document_cache.get("doctor", doctor_id, doctor_id)
+    unchanged = await check_document(doctor_collection, {"_id": ObjectId(doctor_id)}, doctor_id, cached,
+                                     if_none_match, if_modified_since, selected)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        return json_response(select(cached["body"], selected), headers=document_headers("doctor", doctor_id, cached, selected))
+
+    doctor = await doctor_collection.find_one({"_id": ObjectId(doctor_id)}, projection(selected))
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return DoctorResponse(**doctor)
+    body = serialize_document(doctor, partial_model(DoctorResponse, selected))
+    # Only full bodies are cached; field selections are trimmed from them
+    if selected is None:
+        await document_cache.set("doctor", doctor_id, doctor_id, cache_entry(body, doctor))
+    return json_response(body, headers=document_headers("doctor", doctor_id, doctor, selected))
 
 # Update doctor profile
 @router.put("/{doctor_id}", response_model=dict)
 async def update_doctor(doctor_id: str, update: DoctorUpdate, current_id: str = Depends(get_current_doctor)):
+    from pymongo.errors import DuplicateKeyError
+
     if doctor_id != current_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
 
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     update_data["updated_at"] = int(datetime.now().timestamp())
 
-    result = await doctor_collection.update_one(
-        {"_id": ObjectId(doctor_id)},
-        {"$set": update_data}
-    )
+    try:
+        result = await doctor_collection.update_one(
+            {"_id": ObjectId(doctor_id)},
+            {"$set": update_data, "$inc": {"rev": 1}}
+        )
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail=f"User with this {duplicate_key_field(e)} already exists")
+    await document_cache.invalidate("doctor", doctor_id, doctor_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="No changes made")
     return {"message": "Doctor updated successfully"}
@@ -146,7 +205,9 @@ async def delete_doctor(doctor_id: str, current_id: str = Depends(get_current_do
         raise HTTPException(status_code=403, detail="Unauthorized")
 
     result = await doctor_collection.delete_one({"_id": ObjectId(doctor_id)})
+    await document_cache.invalidate("doctor", doctor_id, doctor_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Doctor not found")
+    await doctor_stats_collection.delete_one({"_id": doctor_id})
     return {"message": "Doctor deleted successfully"}
 
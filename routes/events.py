@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from utils.dependency import get_current_doctor
+from utils.events import EVENT_MEDIA_TYPE, event_stream
+
+router = APIRouter()
+
+
+# Live insert/update/delete events for the caller's patients and prescriptions
+@router.get("")
+async def stream_events(doctor_id: str = Depends(get_current_doctor),
+        last_event_id: Optional[str] = Header(None),
+        resume: Optional[str] = Query(None, description="Last event id, for clients that cannot set Last-Event-ID")):
+    return StreamingResponse(
+        event_stream(doctor_id, last_event_id or resume),
+        media_type=EVENT_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
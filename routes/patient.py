@@ -1,46 +1,74 @@
-from fastapi import APIRouter, HTTPException,status, Depends
+from fastapi import APIRouter, HTTPException,status, Depends, Header, Query, Request
 from bson import ObjectId
-from mongodb.connection import client, patient_collection
+from mongodb.connection import duplicate_key_field, patient_collection, prescription_collection
 from model.patient import PatientResponse, CreatePatient, UpdatePatient
+from model.prescription import PrescriptionResponse
 from utils.dependency import get_current_doctor
+from model.batch import BatchIds
+from utils.batch import fetch_by_ids
+from utils.bulk import BULK_CHUNK_SIZE, BULK_MAX_CHUNK_SIZE, insert_unordered, iter_chunks, write_error_message
+from utils.cache import cache_entry, document_cache
+from utils.fields import parse_fields, partial_model, projection, select
+from utils.conditional import check_document, document_headers
+from utils.doctor_stats import bump
+from utils.events import notify_change
+from utils.idempotency import idempotency_store
+from utils.ownership import ownership_index
+from utils.serialization import json_response, serialize_document, serialize_documents
+from utils.timerange import created_between
+from utils.pagination import MAX_PAGE_LIMIT, NEWEST_FIRST, encode_cursor, keyset_query, list_response
 from datetime import datetime
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def patient_document(patient: CreatePatient, doctor_id: str, current_time: int) -> dict:
+    """Build the stored document for a new patient"""
+    return {
+        "doctor_id": doctor_id,
+        "username": patient.username.lower(),
+        "email": patient.email.lower(),
+        "PhoneNumber": patient.PhoneNumber,
+        "age": patient.age,
+        "gender": patient.gender,
+        "weight": patient.weight,
+        "created_at": current_time,
+        "updated_at": current_time,
+        "rev": 1
+    }
+
+
 @router.post("/create", response_model=dict, status_code=status.HTTP_201_CREATED)
-async def create_patient(patient: CreatePatient, doctor_id: str = Depends(get_current_doctor)):
+async def create_patient(patient: CreatePatient, doctor_id: str = Depends(get_current_doctor),
+                         idempotency_key: Optional[str] = Header(None)):
+    # A retry with the same Idempotency-Key gets the first response back
+    return await idempotency_store.run(idempotency_key, "patient.create", doctor_id, patient,
+                                       lambda: _create_patient(patient, doctor_id))
+
+
+async def _create_patient(patient: CreatePatient, doctor_id: str) -> dict:
+    from pymongo.errors import DuplicateKeyError
 
     try:
-        # Check if user already exists
-        existing_patient = await patient_collection.find_one({
-            "$or": [
-                {"email": patient.email.lower()},
-                {"username": patient.username.lower()}
-            ]
-        })
-        print(f"Existing doctor found: {existing_patient}")
-        if existing_patient:
+        # Create user document
+        current_time = int(datetime.now().timestamp())
+        patient_dict = patient_document(patient, doctor_id, current_time)
+
+        # Insert into database; unique indexes on email and username reject duplicates
+        try:
+            result = await patient_collection.insert_one(patient_dict)
+        except DuplicateKeyError as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="User with this email or username already exists"
+                detail=f"User with this {duplicate_key_field(e)} already exists"
             )
-
-            # Create user document
-        current_time = int(datetime.now().timestamp())
-        patient_dict = {
-            "doctor_id": doctor_id,
-            "username": patient.username.lower(),
-            "email": patient.email.lower(),
-            "PhoneNumber": patient.PhoneNumber,
-            "age": patient.age,
-            "gender": patient.gender,
-            "weight": patient.weight,
-            "created_at": current_time,
-            "updated_at": current_time
-        }
-
-        # Insert into database
-        result = await patient_collection.insert_one(patient_dict)
+        ownership_index.add(doctor_id, str(result.inserted_id))
+        await bump(doctor_id, patients=1)
+        await notify_change(patient_collection, "insert", doctor_id, str(result.inserted_id), patient_dict)
 
         return {
             "message": "Patient registered successfully",
@@ -49,39 +77,139 @@ async def create_patient(patient: CreatePatient, doctor_id: str = Depends(get_cu
         }
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error during registration: {e}")
+    except Exception:
+        logger.exception("Patient registration failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Registration failed"
         )
 
+# Import many patients from a JSON array, NDJSON or CSV upload
+@router.post("/bulk", response_model=dict)
+async def bulk_create_patients(request: Request, doctor_id: str = Depends(get_current_doctor),
+        chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=BULK_MAX_CHUNK_SIZE)):
+    results = []
+    async for chunk in iter_chunks(request, CreatePatient, chunk_size):
+        current_time = int(datetime.now().timestamp())
+        pending = []
+        for index, patient, error in chunk:
+            if error:
+                results.append({"index": index, "status": "error", "error": error})
+            else:
+                pending.append((index, patient_document(patient, doctor_id, current_time)))
+
+        write_errors = await insert_unordered(patient_collection, [doc for _, doc in pending])
+        for position, (index, doc) in enumerate(pending):
+            if position in write_errors:
+                results.append({"index": index, "status": "error", "error": write_error_message(write_errors[position])})
+            else:
+                ownership_index.add(doctor_id, str(doc["_id"]))
+                await notify_change(patient_collection, "insert", doctor_id, str(doc["_id"]), doc)
+                results.append({"index": index, "status": "created", "Patient_id": str(doc["_id"])})
+
+        await bump(doctor_id, patients=len(pending) - len(write_errors))
+
+    results.sort(key=lambda r: r["index"])
+    created = sum(1 for r in results if r["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+# Several patients by id in one query; results follow the request order, unknown ids are listed in "missing"
+@router.post("/batch", response_model=dict)
+async def get_patients_batch(batch: BatchIds, doctor_id: str = Depends(get_current_doctor), fields: Optional[str] = None,
+        accept_encoding: Optional[str] = Header(None)):
+    selected = parse_fields(fields, PatientResponse)
+    return json_response(await fetch_by_ids(patient_collection, doctor_id, batch.ids, PatientResponse, selected), accept_encoding)
+
 # Get all patients for logged-in doctor
 @router.get("/all", response_model=list[PatientResponse])
-async def get_all_patients(doctor_id: str = Depends(get_current_doctor)):
-    patients = await patient_collection.find({"doctor_id": doctor_id}).to_list(100)
-    return [PatientResponse(**p) for p in patients]
+async def get_all_patients(doctor_id: str = Depends(get_current_doctor), limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+        cursor: Optional[str] = None, fields: Optional[str] = None, accept: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
+    return await list_response(patient_collection, {"doctor_id": doctor_id}, PatientResponse, limit, cursor, fields, accept, accept_encoding,
+                               if_none_match)
 
 # Get patient by ID
 @router.get("/{patient_id}", response_model=PatientResponse)
-async def get_patient(patient_id: str, doctor_id: str = Depends(get_current_doctor)):
+async def get_patient(patient_id: str, doctor_id: str = Depends(get_current_doctor),
+        fields: Optional[str] = None, if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None)):
     if not ObjectId.is_valid(patient_id):
         raise HTTPException(status_code=400, detail="Invalid patient ID")
+    selected = parse_fields(fields, PatientResponse)
+
+    cached = await document_cache.get("patient", doctor_id, patient_id)
+    unchanged = await check_document(patient_collection, {"_id": ObjectId(patient_id), "doctor_id": doctor_id}, patient_id, cached,
+                                     if_none_match, if_modified_since, selected)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        return json_response(select(cached["body"], selected), headers=document_headers("patient", patient_id, cached, selected))
 
     patient = await patient_collection.find_one({
         "_id": ObjectId(patient_id),
         "doctor_id": doctor_id
-    })
-    print("Looking for patient:", patient_id)
-    print("Doctor making request:", doctor_id)
+    }, projection(selected))
+    logger.debug("Patient lookup", extra={"patient_id": patient_id, "doctor_id": doctor_id})
 
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return PatientResponse(**patient)
+    body = serialize_document(patient, partial_model(PatientResponse, selected))
+    # Only full bodies are cached; field selections are trimmed from them
+    if selected is None:
+        await document_cache.set("patient", doctor_id, patient_id, cache_entry(body, patient))
+    return json_response(body, headers=document_headers("patient", patient_id, patient, selected))
+
+# Patient chart: patient plus prescriptions newest-first, in one aggregation
+@router.get("/{patient_id}/history", response_model=dict)
+async def get_patient_history(patient_id: str, doctor_id: str = Depends(get_current_doctor),
+        limit: int = Query(20, ge=1, le=MAX_PAGE_LIMIT), cursor: Optional[str] = None,
+        date_from: Optional[int] = Query(None, alias="from"), date_to: Optional[int] = Query(None, alias="to"),
+        fields: Optional[str] = Query(None, description="Prescription fields to return"),
+        patient_fields: Optional[str] = None, accept_encoding: Optional[str] = Header(None)):
+    if not ObjectId.is_valid(patient_id):
+        raise HTTPException(status_code=400, detail="Invalid patient ID")
+    selected = parse_fields(fields, PrescriptionResponse)
+    patient_selected = parse_fields(patient_fields, PatientResponse)
+
+    prescription_match = created_between({"doctor_id": doctor_id, "patient_id": patient_id}, date_from, date_to)
+
+    prescription_pipeline = [
+        {"$match": keyset_query(prescription_match, cursor, descending=True)},
+        {"$sort": dict(NEWEST_FIRST)},
+        # One extra document tells us whether there is a next page
+        {"$limit": limit + 1},
+    ]
+    if selected:
+        prescription_pipeline.append({"$project": projection(selected)})
+    pipeline = [{"$match": {"_id": ObjectId(patient_id), "doctor_id": doctor_id}}]
+    if patient_selected:
+        pipeline.append({"$project": projection(patient_selected)})
+    pipeline.append({"$lookup": {
+        "from": prescription_collection.name,
+        "pipeline": prescription_pipeline,
+        "as": "prescriptions",
+    }})
+    results = await patient_collection.aggregate(pipeline).to_list(1)
+    if not results:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    patient = results[0]
+    prescriptions = patient.pop("prescriptions")
+    next_cursor = None
+    if len(prescriptions) > limit:
+        prescriptions = prescriptions[:limit]
+        next_cursor = encode_cursor(prescriptions[-1])
+    return json_response({
+        "patient": serialize_document(patient, partial_model(PatientResponse, patient_selected)),
+        "prescriptions": serialize_documents(prescriptions, partial_model(PrescriptionResponse, selected)),
+        "next_cursor": next_cursor,
+    }, accept_encoding)
 
 # Update patient
 @router.put("/{patient_id}", response_model=dict)
 async def update_patient(patient_id: str, update: UpdatePatient, doctor_id: str = Depends(get_current_doctor)):
+    from pymongo.errors import DuplicateKeyError
+
     if not ObjectId.is_valid(patient_id):
         raise HTTPException(status_code=400, detail="Invalid patient ID")
 
@@ -92,12 +220,17 @@ async def update_patient(patient_id: str, update: UpdatePatient, doctor_id: str
 
     update_data["updated_at"] = int(datetime.now().timestamp())
 
-    result = await patient_collection.update_one(
-        {"_id": ObjectId(patient_id), "doctor_id": doctor_id},
-        {"$set": update_data}
-    )
+    try:
+        result = await patient_collection.update_one(
+            {"_id": ObjectId(patient_id), "doctor_id": doctor_id},
+            {"$set": update_data, "$inc": {"rev": 1}}
+        )
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail=f"User with this {duplicate_key_field(e)} already exists")
+    await document_cache.invalidate("patient", doctor_id, patient_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Patient not found or no changes made")
+    await notify_change(patient_collection, "update", doctor_id, patient_id)
     return {"message": "Patient updated successfully"}
 
 # Delete patient
@@ -110,7 +243,11 @@ async def delete_patient(patient_id: str, doctor_id: str = Depends(get_current_d
         "_id": ObjectId(patient_id),
         "doctor_id": doctor_id
     })
+    await document_cache.invalidate("patient", doctor_id, patient_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Patient not found")
+    ownership_index.discard(patient_id, doctor_id)
+    await bump(doctor_id, patients=-1)
+    await notify_change(patient_collection, "delete", doctor_id, patient_id)
     return {"message": "Patient deleted successfully"}
 
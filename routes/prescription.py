@@ -1,43 +1,93 @@
-from fastapi import APIRouter, HTTPException,status, Depends
+from fastapi import APIRouter, HTTPException,status, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from mongodb.connection import prescription_collection
 from model.prescription import  CreatePrescription, PrescriptionResponse, UpdatePrescription
 from mongodb.connection import patient_collection
 from utils.dependency import get_current_doctor
+from model.batch import BatchIds
+from utils.batch import fetch_by_ids
+from utils.bulk import BULK_CHUNK_SIZE, BULK_MAX_CHUNK_SIZE, insert_unordered, iter_chunks, write_error_message
+from utils.cache import cache_entry, document_cache
+from utils.export import EXPORT_BATCH_SIZE, PRESCRIPTION_CSV_COLUMNS, prescription_rows, stream_csv
+from utils.fields import parse_fields, partial_model, projection, select
+from utils.conditional import check_document, document_headers
+from utils.doctor_stats import bump, day_key
+from utils.events import notify_change
+from utils.idempotency import idempotency_store
+from utils.medicine_index import MEDICINE_SUGGEST_LIMIT, medicine_index, record_medicines
+from utils.ownership import ownership_index
+from utils.serialization import json_response, serialize_document, serialize_documents
+from utils.timerange import DAY_SECONDS, created_between
+from utils.pagination import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, NDJSON_MEDIA_TYPE, list_response, stream_ndjson
 from bson import ObjectId
 
 
+from collections import Counter
 from datetime import datetime
+import json
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def follow_up_due_at(created_at: int, follow_up_days: Optional[int]) -> Optional[int]:
+    """Timestamp the follow-up falls due, in the same seconds as created_at"""
+    return created_at + follow_up_days * DAY_SECONDS if follow_up_days else None
+
+
+def prescription_document(prescription: CreatePrescription, doctor_id: str, current_time: int) -> dict:
+    """Build the stored document for a new prescription"""
+    return {
+        "doctor_id": doctor_id,
+        "patient_id": prescription.patient_id,
+        "symptoms":prescription.symptoms,
+        "medicines": [med.model_dump() for med in prescription.medicines],
+        "notes": prescription.notes,
+        "follow_up_days": prescription.follow_up_days,
+        "follow_up_due_at": follow_up_due_at(current_time, prescription.follow_up_days),
+        "created_at": current_time,
+        "updated_at": current_time,
+        "rev": 1
+    }
+
+
+def _parse_csv_medicines(record: dict) -> dict:
+    """CSV uploads carry medicines as a JSON array in a single column"""
+    if isinstance(record.get("medicines"), str):
+        try:
+            record["medicines"] = json.loads(record["medicines"])
+        except ValueError:
+            pass
+    return record
+
+
 @router.post("/create", response_model=dict, status_code=status.HTTP_201_CREATED)
-async def create_prescription(prescription: CreatePrescription, doctor_id: str = Depends(get_current_doctor)):
+async def create_prescription(prescription: CreatePrescription, doctor_id: str = Depends(get_current_doctor),
+                              idempotency_key: Optional[str] = Header(None)):
+    # A retry with the same Idempotency-Key gets the first response back
+    return await idempotency_store.run(idempotency_key, "prescription.create", doctor_id, prescription,
+                                       lambda: _create_prescription(prescription, doctor_id))
+
+
+async def _create_prescription(prescription: CreatePrescription, doctor_id: str) -> dict:
 
     try:
 
-        patient = await patient_collection.find_one({
-            "_id": ObjectId(prescription.patient_id),
-            "doctor_id": doctor_id
-        })
-        if not patient:
+        # Answered from the per-worker ownership index, so the write is usually the only round trip
+        if not await ownership_index.owns(doctor_id, prescription.patient_id):
             raise HTTPException(status_code=403, detail="Unauthorized: Patient does not belong to you")
 
         current_time = int(datetime.now().timestamp())
-
-        medicines_list = [med.model_dump() for med in prescription.medicines]
-        prescription_dict = {
-            "doctor_id": doctor_id,
-            "patient_id": prescription.patient_id,
-            "symptoms":prescription.symptoms,
-            "medicines": medicines_list,
-            "notes": prescription.notes,
-            "follow_up_days": prescription.follow_up_days,
-            "created_at": current_time,
-            "updated_at": current_time
-        }
+        prescription_dict = prescription_document(prescription, doctor_id, current_time)
 
         # Insert into database
         result = await prescription_collection.insert_one(prescription_dict)
+        record_medicines(doctor_id, prescription_dict["medicines"])
+        await bump(doctor_id, prescriptions=1, days=Counter([day_key(current_time)]))
+        await notify_change(prescription_collection, "insert", doctor_id, str(result.inserted_id), prescription_dict)
 
         return {
             "message": "Prescription created successfully",
@@ -46,30 +96,142 @@ async def create_prescription(prescription: CreatePrescription, doctor_id: str =
         }
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error during registration: {e}")
+    except Exception:
+        logger.exception("Prescription creation failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Registration failed"
         )
 
+# Import many prescriptions from a JSON array, NDJSON or CSV upload
+@router.post("/bulk", response_model=dict)
+async def bulk_create_prescriptions(request: Request, doctor_id: str = Depends(get_current_doctor),
+        chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=BULK_MAX_CHUNK_SIZE)):
+    results = []
+    async for chunk in iter_chunks(request, CreatePrescription, chunk_size, prepare=_parse_csv_medicines):
+        # One ownership query per chunk instead of one find_one per record
+        patient_ids = {p.patient_id for _, p, error in chunk if not error and ObjectId.is_valid(p.patient_id)}
+        owned = set()
+        if patient_ids:
+            async for patient in patient_collection.find(
+                    {"_id": {"$in": [ObjectId(pid) for pid in patient_ids]}, "doctor_id": doctor_id}, {"_id": 1}):
+                owned.add(str(patient["_id"]))
+
+        current_time = int(datetime.now().timestamp())
+        pending = []
+        for index, prescription, error in chunk:
+            if not error and prescription.patient_id not in owned:
+                error = "Unauthorized: Patient does not belong to you"
+            if error:
+                results.append({"index": index, "status": "error", "error": error})
+            else:
+                pending.append((index, prescription_document(prescription, doctor_id, current_time)))
+
+        write_errors = await insert_unordered(prescription_collection, [doc for _, doc in pending])
+        for position, (index, doc) in enumerate(pending):
+            if position in write_errors:
+                results.append({"index": index, "status": "error", "error": write_error_message(write_errors[position])})
+            else:
+                record_medicines(doctor_id, doc["medicines"])
+                await notify_change(prescription_collection, "insert", doctor_id, str(doc["_id"]), doc)
+                results.append({"index": index, "status": "created", "Prescription": str(doc["_id"])})
+
+        created = len(pending) - len(write_errors)
+        await bump(doctor_id, prescriptions=created, days=Counter({day_key(current_time): created}))
+
+    results.sort(key=lambda r: r["index"])
+    created = sum(1 for r in results if r["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+# Every prescription of the doctor as CSV (one row per medicine) or JSON Lines
+@router.get("/export")
+async def export_prescriptions(doctor_id: str = Depends(get_current_doctor),
+        export_format: str = Query("jsonl", alias="format", pattern="^(csv|jsonl)$"),
+        date_from: Optional[int] = Query(None, alias="from"), date_to: Optional[int] = Query(None, alias="to"),
+        patient_id: Optional[str] = None):
+    query = {"doctor_id": doctor_id}
+    if patient_id:
+        query["patient_id"] = patient_id
+    created_between(query, date_from, date_to)
+
+    if export_format == "csv":
+        body = stream_csv(prescription_collection, query, PRESCRIPTION_CSV_COLUMNS, prescription_rows)
+        media_type = "text/csv"
+    else:
+        body = stream_ndjson(prescription_collection, query,
+                             lambda d: {"id": str(d["_id"]), **serialize_document(d, PrescriptionResponse)},
+                             batch_size=EXPORT_BATCH_SIZE)
+        media_type = NDJSON_MEDIA_TYPE
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="prescriptions.{export_format}"'
+    })
+
+# Medicine-name autocomplete, ranked by the doctor's and then the clinic's usage
+@router.get("/medicines/suggest", response_model=list[dict])
+async def suggest_medicines(q: str = Query(..., min_length=1, max_length=100), doctor_id: str = Depends(get_current_doctor),
+        limit: int = Query(MEDICINE_SUGGEST_LIMIT, ge=1, le=50)):
+    return json_response(medicine_index.suggest(doctor_id, q, limit))
+
+# Prescriptions whose follow-up falls due in [from, to], soonest first; defaults to today (UTC)
+@router.get("/follow-ups", response_model=list[PrescriptionResponse])
+async def get_due_follow_ups(doctor_id: str = Depends(get_current_doctor),
+        date_from: Optional[int] = Query(None, alias="from"), date_to: Optional[int] = Query(None, alias="to"),
+        limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT), fields: Optional[str] = None,
+        accept_encoding: Optional[str] = Header(None)):
+    selected = parse_fields(fields, PrescriptionResponse)
+    if date_from is None:
+        date_from = int(datetime.now().timestamp()) // DAY_SECONDS * DAY_SECONDS
+    if date_to is None:
+        date_to = date_from + DAY_SECONDS - 1
+
+    # Range scan on (doctor_id, follow_up_due_at)
+    prescriptions = await prescription_collection.find(
+        {"doctor_id": doctor_id, "follow_up_due_at": {"$gte": date_from, "$lte": date_to}},
+        projection(selected)
+    ).sort([("follow_up_due_at", 1), ("_id", 1)]).limit(limit).to_list(limit)
+    return json_response(serialize_documents(prescriptions, partial_model(PrescriptionResponse, selected)), accept_encoding)
+
+# Several prescriptions by id in one query; results follow the request order, unknown ids are listed in "missing"
+@router.post("/batch", response_model=dict)
+async def get_prescriptions_batch(batch: BatchIds, doctor_id: str = Depends(get_current_doctor), fields: Optional[str] = None,
+        accept_encoding: Optional[str] = Header(None)):
+    selected = parse_fields(fields, PrescriptionResponse)
+    return json_response(await fetch_by_ids(prescription_collection, doctor_id, batch.ids, PrescriptionResponse, selected), accept_encoding)
+
 @router.get("/all", response_model=list[PrescriptionResponse])
-async def get_all_prescriptions(doctor_id: str = Depends(get_current_doctor)):
-    prescriptions = await prescription_collection.find({"doctor_id": doctor_id}).to_list(100)
-    return [PrescriptionResponse(**p) for p in prescriptions]
+async def get_all_prescriptions(doctor_id: str = Depends(get_current_doctor), limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+        cursor: Optional[str] = None, fields: Optional[str] = None, accept: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
+    return await list_response(prescription_collection, {"doctor_id": doctor_id}, PrescriptionResponse, limit, cursor, fields, accept, accept_encoding,
+                               if_none_match)
 
 @router.get("/{prescription_id}", response_model=PrescriptionResponse)
-async def get_prescription(prescription_id: str, doctor_id: str = Depends(get_current_doctor)):
+async def get_prescription(prescription_id: str, doctor_id: str = Depends(get_current_doctor),
+        fields: Optional[str] = None, if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None)):
     if not ObjectId.is_valid(prescription_id):
         raise HTTPException(status_code=400, detail="Invalid prescription ID")
+    selected = parse_fields(fields, PrescriptionResponse)
+
+    cached = await document_cache.get("prescription", doctor_id, prescription_id)
+    unchanged = await check_document(prescription_collection, {"_id": ObjectId(prescription_id), "doctor_id": doctor_id}, prescription_id, cached,
+                                     if_none_match, if_modified_since, selected)
+    if unchanged is not None:
+        return unchanged
+    if cached is not None:
+        return json_response(select(cached["body"], selected), headers=document_headers("prescription", prescription_id, cached, selected))
 
     prescription = await prescription_collection.find_one({
         "_id": ObjectId(prescription_id),
         "doctor_id": doctor_id
-    })
+    }, projection(selected))
     if not prescription:
         raise HTTPException(status_code=404, detail="Prescription not found")
-    return PrescriptionResponse(**prescription)
+    body = serialize_document(prescription, partial_model(PrescriptionResponse, selected))
+    # Only full bodies are cached; field selections are trimmed from them
+    if selected is None:
+        await document_cache.set("prescription", doctor_id, prescription_id, cache_entry(body, prescription))
+    return json_response(body, headers=document_headers("prescription", prescription_id, prescription, selected))
 
 @router.put("/{prescription_id}", response_model=dict)
 async def update_prescription(prescription_id: str, update: UpdatePrescription, doctor_id: str = Depends(get_current_doctor)):
@@ -82,12 +244,29 @@ async def update_prescription(prescription_id: str, update: UpdatePrescription,
 
     update_data["updated_at"] = int(datetime.now().timestamp())
 
-    result = await prescription_collection.update_one(
+    changes = {"$set": update_data, "$inc": {"rev": 1}}
+    if update_data.get("follow_up_days"):
+        # Pipeline update, so the due date is computed from the stored created_at in the same round trip
+        changes = [{"$set": {
+            **{k: {"$literal": v} for k, v in update_data.items()},
+            "follow_up_due_at": {"$add": ["$created_at", update_data["follow_up_days"] * DAY_SECONDS]},
+            "rev": {"$add": [{"$ifNull": ["$rev", 0]}, 1]},
+        }}]
+    from pymongo import ReturnDocument
+
+    # The old medicine list comes back in the same round trip, so the index can drop its counts
+    previous = await prescription_collection.find_one_and_update(
         {"_id": ObjectId(prescription_id), "doctor_id": doctor_id},
-        {"$set": update_data}
+        changes,
+        projection={"medicines": 1},
+        return_document=ReturnDocument.BEFORE
     )
-    if result.modified_count == 0:
+    await document_cache.invalidate("prescription", doctor_id, prescription_id)
+    if previous is None:
         raise HTTPException(status_code=404, detail="Prescription not found or no changes made")
+    if "medicines" in update_data:
+        record_medicines(doctor_id, update_data["medicines"], previous.get("medicines") or [])
+    await notify_change(prescription_collection, "update", doctor_id, prescription_id)
     return {"message": "Prescription updated successfully"}
 
 @router.delete("/{prescription_id}", response_model=dict)
@@ -95,10 +274,15 @@ async def delete_prescription(prescription_id: str, doctor_id: str = Depends(get
     if not ObjectId.is_valid(prescription_id):
         raise HTTPException(status_code=400, detail="Invalid prescription ID")
 
-    result = await prescription_collection.delete_one({
+    # find_one_and_delete hands back created_at for the daily bucket and the medicines in the same round trip
+    deleted = await prescription_collection.find_one_and_delete({
         "_id": ObjectId(prescription_id),
         "doctor_id": doctor_id
-    })
-    if result.deleted_count == 0:
+    }, projection={"created_at": 1, "medicines": 1})
+    await document_cache.invalidate("prescription", doctor_id, prescription_id)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Prescription not found")
+    await bump(doctor_id, prescriptions=-1, days=Counter({day_key(deleted["created_at"]): -1}))
+    record_medicines(doctor_id, None, deleted.get("medicines") or [])
+    await notify_change(prescription_collection, "delete", doctor_id, prescription_id)
     return {"message": "Prescription deleted successfully"}
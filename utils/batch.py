@@ -0,0 +1,28 @@
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from utils.fields import partial_model, projection
+from utils.serialization import serialize_document
+
+
+async def fetch_by_ids(collection, doctor_id: str, ids: list[str], model: type[BaseModel],
+                       fields: Optional[tuple[str, ...]] = None) -> dict:
+    """Resolve ids with one $in query scoped to the doctor, keeping request order"""
+    invalid = [doc_id for doc_id in ids if not ObjectId.is_valid(doc_id)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid IDs: {', '.join(invalid)}")
+
+    unique = list(dict.fromkeys(ids))
+    query = {"_id": {"$in": [ObjectId(doc_id) for doc_id in unique]}, "doctor_id": doctor_id}
+    shape = partial_model(model, fields)
+    found = {}
+    async for doc in collection.find(query, projection(fields)).batch_size(len(unique)):
+        found[str(doc["_id"])] = serialize_document(doc, shape)
+
+    return {
+        "results": [{"id": doc_id, "document": found.get(doc_id)} for doc_id in ids],
+        "missing": [doc_id for doc_id in unique if doc_id not in found],
+    }
@@ -0,0 +1,170 @@
+import csv
+import codecs
+import json
+import os
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+
+from utils.pagination import NDJSON_MEDIA_TYPE
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_CHUNK_SIZE = 5000
+BULK_MAX_RECORDS = int(os.getenv("BULK_MAX_RECORDS", "50000"))
+
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    """Decode the request body into lines as it streams in, each keeping its newline"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+class _LineFeed:
+    """Lines handed to a csv.reader; it can be topped up after the reader drained it"""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def _iter_csv_rows(request: Request) -> AsyncIterator[Optional[list[str]]]:
+    """Parse a CSV upload with one reader across the stream, so quoted fields keep their newlines.
+
+    A row is read once its lines close every quote they open; yields None for a
+    trailing row whose quote is never closed.
+    """
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    quoted = False
+    async for line in _iter_lines(request):
+        if not quoted and not line.strip():
+            continue
+        feed.lines.append(line)
+        # "" escapes a quote inside a quoted field, so only an odd count opens or closes one
+        if line.count('"') % 2:
+            quoted = not quoted
+        if not quoted:
+            yield next(reader)
+    if quoted:
+        yield None
+
+
+async def iter_records(request: Request) -> AsyncIterator[tuple[int, Optional[dict], Optional[str]]]:
+    """Yield (index, record, parse_error) from a JSON array, NDJSON or CSV upload"""
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    count = 0
+    # Streamed uploads are written chunk by chunk, so past the limit the import stops
+    # with an error record instead of a 413 that would hide what was already created
+    overflow = f"Upload exceeds {BULK_MAX_RECORDS} records; this record and the rest were not imported"
+
+    if content_type == NDJSON_MEDIA_TYPE:
+        async for line in _iter_lines(request):
+            if not line.strip():
+                continue
+            count += 1
+            if count > BULK_MAX_RECORDS:
+                yield count - 1, None, overflow
+                return
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield count - 1, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(record, dict):
+                yield count - 1, record, None
+            else:
+                yield count - 1, None, "Each line must be a JSON object"
+
+    elif content_type == "text/csv":
+        header = None
+        async for row in _iter_csv_rows(request):
+            if row is not None and header is None:
+                header = [name.strip() for name in row]
+                continue
+            count += 1
+            if count > BULK_MAX_RECORDS:
+                yield count - 1, None, overflow
+                return
+            if row is None:
+                yield count - 1, None, "Unterminated quoted field"
+                return
+            # Empty cells mean "not provided", so optional fields fall back to their defaults
+            yield count - 1, {k: v for k, v in zip(header, row) if v != ""}, None
+
+    elif content_type == "application/json":
+        try:
+            records = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array")
+        if len(records) > BULK_MAX_RECORDS:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RECORDS} records per upload")
+        for index, record in enumerate(records):
+            if isinstance(record, dict):
+                yield index, record, None
+            else:
+                yield index, None, "Each record must be a JSON object"
+
+    else:
+        raise HTTPException(status_code=415, detail="Use application/json, application/x-ndjson or text/csv")
+
+
+async def iter_chunks(request: Request, model: type[BaseModel], chunk_size: int, prepare=None):
+    """Validate records with the create model and group them into chunks.
+
+    Yields lists of (index, validated model or None, error or None).
+    """
+    chunk = []
+    async for index, record, error in iter_records(request):
+        if error is None:
+            try:
+                if prepare:
+                    record = prepare(record)
+                record = model.model_validate(record)
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                record = None
+        chunk.append((index, record, error))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def insert_unordered(collection, docs: list[dict]) -> dict[int, dict]:
+    """insert_many(ordered=False); returns write errors keyed by position in docs"""
+    from pymongo.errors import BulkWriteError
+
+    if not docs:
+        return {}
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"]: error for error in e.details.get("writeErrors", [])}
+    return {}
+
+
+def write_error_message(error: dict) -> str:
+    if error.get("code") == 11000:
+        field = next(iter(error.get("keyPattern") or {}), "email or username")
+        return f"User with this {field} already exists"
+    return error.get("errmsg", "Write failed")
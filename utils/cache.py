@@ -0,0 +1,145 @@
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+from utils.serialization import dumps
+
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+# Comma separated collections to bypass, e.g. "doctor,prescription"
+CACHE_DISABLED_COLLECTIONS = {c.strip() for c in os.getenv("CACHE_DISABLED_COLLECTIONS", "").split(",") if c.strip()}
+# Set to share entries (and invalidations) between workers through Redis
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+
+class MemoryBackend:
+    """In-process TTL + LRU store"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared store so every worker sees the same entries and invalidations"""
+
+    def __init__(self, url: str, ttl: int = CACHE_TTL_SECONDS):
+        import orjson
+        import redis.asyncio as redis
+
+        self._loads = orjson.loads
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+        # Redis evicts on its own; these stay at zero
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self._redis.get(key)
+        return self._loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict):
+        await self._redis.set(key, dumps(value), ex=self.ttl)
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    def size(self) -> int:
+        return -1
+
+
+def cache_entry(body: dict, doc: dict) -> dict:
+    """What the document cache holds: the full response body plus the validators of its document"""
+    return {"body": body, "updated_at": doc.get("updated_at"), "rev": doc.get("rev")}
+
+
+class DocumentCache:
+    """Read-through cache for single documents, keyed by collection, owning doctor and _id"""
+
+    def __init__(self, backend, disabled: set[str] = frozenset()):
+        self.backend = backend
+        self.disabled = set(disabled)
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.invalidations = defaultdict(int)
+
+    def enabled(self, collection: str) -> bool:
+        return collection not in self.disabled
+
+    @staticmethod
+    def key(collection: str, doctor_id: str, doc_id: str) -> str:
+        # v2 entries are cache_entry() dicts; the prefix keeps bare bodies in a shared Redis from being read
+        return f"doc:v2:{collection}:{doctor_id}:{doc_id}"
+
+    async def get(self, collection: str, doctor_id: str, doc_id: str) -> Optional[dict]:
+        if not self.enabled(collection):
+            return None
+        value = await self.backend.get(self.key(collection, doctor_id, doc_id))
+        if value is None:
+            self.misses[collection] += 1
+        else:
+            self.hits[collection] += 1
+        return value
+
+    async def set(self, collection: str, doctor_id: str, doc_id: str, value: dict):
+        if self.enabled(collection):
+            await self.backend.set(self.key(collection, doctor_id, doc_id), value)
+
+    async def invalidate(self, collection: str, doctor_id: str, doc_id: str):
+        if self.enabled(collection):
+            self.invalidations[collection] += 1
+            await self.backend.delete(self.key(collection, doctor_id, doc_id))
+
+    def stats(self) -> dict:
+        collections = {}
+        for collection in set(self.hits) | set(self.misses) | set(self.invalidations):
+            lookups = self.hits[collection] + self.misses[collection]
+            collections[collection] = {
+                "hits": self.hits[collection],
+                "misses": self.misses[collection],
+                "invalidations": self.invalidations[collection],
+                "hit_ratio": self.hits[collection] / lookups if lookups else 0.0,
+            }
+        return {
+            "backend": type(self.backend).__name__,
+            "size": self.backend.size(),
+            "evictions": self.backend.evictions,
+            "expirations": self.backend.expirations,
+            "disabled": sorted(self.disabled),
+            "collections": collections,
+        }
+
+
+document_cache = DocumentCache(
+    RedisBackend(CACHE_REDIS_URL) if CACHE_REDIS_URL else MemoryBackend(),
+    CACHE_DISABLED_COLLECTIONS,
+)
@@ -0,0 +1,87 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Response
+
+
+def weak_etag(*parts) -> str:
+    """Weak validator: the same parts always give the same tag"""
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def http_date(timestamp: int) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(etag: str, last_modified: Optional[int], if_none_match: Optional[str],
+                    if_modified_since: Optional[str]) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no If-None-Match was sent (RFC 9110)"""
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/ prefixes are ignored on both sides
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in tags
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified <= int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[int]) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def document_validators(collection_name: str, doc_id: str, version: dict,
+                        fields: Optional[tuple] = None) -> tuple[str, Optional[int]]:
+    """(ETag, Last-Modified timestamp) for a single document, per field selection.
+
+    version carries updated_at and rev; rev moves on every write, so two edits
+    within one second of updated_at still give different tags.
+    """
+    updated_at = version.get("updated_at")
+    return weak_etag(collection_name, doc_id, updated_at, version.get("rev"), fields), updated_at
+
+
+def page_etag(collection_name: str, docs: list[dict], next_cursor: Optional[str], fields: Optional[tuple] = None) -> str:
+    """ETag for one page of a listing, from the ids and revisions of the documents on it.
+
+    Taken from the page query itself, so it costs no extra round trip, and it
+    changes when a document on the page is edited, added or deleted. Listings
+    send no Last-Modified: a delete does not move the newest updated_at.
+    """
+    return weak_etag(collection_name, fields, next_cursor,
+                     *(f"{doc['_id']}:{doc.get('updated_at')}:{doc.get('rev')}" for doc in docs))
+
+
+def document_headers(collection_name: str, doc_id: str, doc: dict, fields: Optional[tuple] = None) -> dict:
+    """Validators for a stored document or a document cache entry"""
+    return validator_headers(*document_validators(collection_name, doc_id, doc, fields))
+
+
+async def check_document(collection, query: dict, doc_id: str, cached: Optional[dict],
+                         if_none_match: Optional[str], if_modified_since: Optional[str],
+                         fields: Optional[tuple] = None) -> Optional[Response]:
+    """304 when the client's copy is current, reading only updated_at and rev; None otherwise"""
+    if not (if_none_match or if_modified_since):
+        return None
+    version = cached
+    if version is None:
+        version = await collection.find_one(query, {"_id": 0, "updated_at": 1, "rev": 1})
+        if version is None:
+            return None
+    etag, last_modified = document_validators(collection.name, doc_id, version, fields)
+    if is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+        return not_modified(validator_headers(etag, last_modified))
+    return None
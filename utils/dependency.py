@@ -1,13 +1,16 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from utils.jwt import verify_access_token
+from utils.token_cache import token_cache
 
 # No tokenUrl needed here
 security = HTTPBearer()
 
-async def get_current_doctor(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials  # Extract token string
-    payload = verify_access_token(token)
+    payload = token_cache.verify(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return payload
+
+async def get_current_doctor(payload: dict = Depends(get_current_claims)):
     return payload["doctor_id"]
@@ -0,0 +1,111 @@
+"""Per-doctor dashboard counters kept in doctor_stats, one document per doctor.
+
+    {_id: doctor_id, patients: int, prescriptions: int, daily: {"YYYY-MM-DD": int}, updated_at: int}
+
+Route handlers $inc them as they write. The repair job rebuilds them from the
+source collections:
+
+    python -m utils.doctor_stats
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from mongodb.connection import doctor_stats_collection, manager, patient_collection, prescription_collection
+from utils.timerange import DAY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+STATS_MAX_DAYS = 366
+
+
+def day_key(timestamp: int) -> str:
+    """UTC day bucket for a created_at timestamp"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+async def bump(doctor_id: str, patients: int = 0, prescriptions: int = 0, days: Optional[Counter] = None):
+    """Atomically adjust a doctor's counters; days maps day keys to prescription deltas.
+
+    Runs after the document write has succeeded. A failure here is logged
+    instead of failing the request, and the repair job corrects the drift.
+    """
+    inc = {"patients": patients, "prescriptions": prescriptions}
+    inc.update({f"daily.{day}": delta for day, delta in (days or {}).items()})
+    inc = {field: delta for field, delta in inc.items() if delta}
+    if not inc:
+        return
+    try:
+        await doctor_stats_collection.update_one(
+            {"_id": doctor_id},
+            {"$inc": inc, "$set": {"updated_at": int(datetime.now().timestamp())}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning("Doctor stats update failed for %s: %s", doctor_id, e)
+
+
+async def read_stats(doctor_id: str, days: int) -> dict:
+    """One point read by _id, projecting only the requested day buckets"""
+    today = datetime.now(timezone.utc).date()
+    keys = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+    projection = {"patients": 1, "prescriptions": 1, "updated_at": 1, **{f"daily.{key}": 1 for key in keys}}
+    doc = await doctor_stats_collection.find_one({"_id": doctor_id}, projection) or {}
+    daily = doc.get("daily", {})
+    return {
+        "patients": doc.get("patients", 0),
+        "prescriptions": doc.get("prescriptions", 0),
+        "daily": {key: daily.get(key, 0) for key in keys},
+        "updated_at": doc.get("updated_at"),
+    }
+
+
+async def repair_doctor_stats(doctor_id: Optional[str] = None) -> int:
+    """Rebuild counters with aggregations over patient and prescription.
+
+    Increments that land while a doctor's document is being replaced are
+    lost, so run it when traffic is low (or per doctor). Returns the number
+    of documents written.
+    """
+    match = {"doctor_id": doctor_id} if doctor_id else {}
+    stats = defaultdict(lambda: {"patients": 0, "prescriptions": 0, "daily": {}})
+
+    async for row in patient_collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$doctor_id", "count": {"$sum": 1}}},
+    ]):
+        stats[row["_id"]]["patients"] = row["count"]
+
+    async for row in prescription_collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            # Start of the UTC day, turned into a day key below
+            "_id": {"doctor_id": "$doctor_id", "day": {"$subtract": ["$created_at", {"$mod": ["$created_at", DAY_SECONDS]}]}},
+            "count": {"$sum": 1},
+        }},
+    ], allowDiskUse=True):
+        entry = stats[row["_id"]["doctor_id"]]
+        entry["prescriptions"] += row["count"]
+        entry["daily"][day_key(row["_id"]["day"])] = row["count"]
+
+    # Doctors whose documents are all gone still get their counters zeroed
+    async for doc in doctor_stats_collection.find({"_id": doctor_id} if doctor_id else {}, {"_id": 1}):
+        stats[doc["_id"]]
+
+    now = int(datetime.now().timestamp())
+    for owner, entry in stats.items():
+        await doctor_stats_collection.replace_one({"_id": owner}, {**entry, "updated_at": now}, upsert=True)
+    return len(stats)
+
+
+async def main():
+    try:
+        print(f"Rebuilt stats for {await repair_doctor_stats()} doctors")
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict, deque
+from itertools import count
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId
+
+from model.patient import PatientResponse
+from model.prescription import PrescriptionResponse
+from mongodb.change_stream import change_feed
+from utils.serialization import dumps, serialize_document
+
+logger = logging.getLogger(__name__)
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+# Recent events kept per worker so a reconnecting client can resume from Last-Event-ID
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", "1000"))
+EVENTS_HEARTBEAT_SECONDS = int(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENT_MEDIA_TYPE = "text/event-stream"
+
+RESPONSE_MODELS = {"patient": PatientResponse, "prescription": PrescriptionResponse}
+OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+HEARTBEAT = b": keep-alive\n\n"
+# Tells the client it missed events and should reload its lists
+RESET = b"event: reset\ndata: {}\n\n"
+
+
+def sse_frame(event_id: str, name: str, data: dict) -> bytes:
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), name.encode(), dumps(data))
+
+
+class EventHub:
+    """Fans patient/prescription changes out to each doctor's open event streams"""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, replay_size: int = EVENTS_REPLAY_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        # (event id, doctor_id, frame), oldest first
+        self._recent: deque[tuple[str, str, bytes]] = deque(maxlen=replay_size)
+        self._local_ids = count(1)
+        self._local_prefix = f"{os.getpid():x}-"
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, doctor_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[doctor_id].add(queue)
+        return queue
+
+    def unsubscribe(self, doctor_id: str, queue: asyncio.Queue):
+        self._subscribers[doctor_id].discard(queue)
+        if not self._subscribers[doctor_id]:
+            del self._subscribers[doctor_id]
+
+    def has_subscribers(self, doctor_id: str) -> bool:
+        return doctor_id in self._subscribers
+
+    def build_frame(self, event_id: str, collection: str, operation: str, doc_id: str,
+                    document: Optional[dict]) -> bytes:
+        body = serialize_document(document, RESPONSE_MODELS[collection]) if document else None
+        return sse_frame(event_id, f"{collection}.{operation}",
+                         {"collection": collection, "operation": operation, "id": doc_id, "document": body})
+
+    def publish(self, doctor_id: str, event_id: str, frame: bytes):
+        self._recent.append((event_id, doctor_id, frame))
+        self.published += 1
+        for queue in self._subscribers.get(doctor_id, ()):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # A client this far behind reloads instead of holding events in memory
+                self.dropped += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET)
+
+    @staticmethod
+    def change_owner(change: dict) -> Optional[str]:
+        """Doctor a change event belongs to, or None when it cannot be told.
+
+        Deletes without a pre-image carry only the document key; the route
+        that made them publishes those instead (see notify_change).
+        """
+        document = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+        return document.get("doctor_id") if document else None
+
+    def change_frame(self, change: dict) -> Optional[tuple[str, bytes]]:
+        """(doctor_id, frame) for a change stream event"""
+        operation = OPERATIONS.get(change["operationType"])
+        if operation is None:
+            return None
+        doctor_id = self.change_owner(change)
+        if doctor_id is None:
+            return None
+        frame = self.build_frame(change["_id"]["_data"], change["ns"]["coll"], operation,
+                                 str(change["documentKey"]["_id"]), change.get("fullDocument"))
+        return doctor_id, frame
+
+    def on_change(self, change: dict):
+        built = self.change_frame(change)
+        if built is not None:
+            self.publish(built[0], change["_id"]["_data"], built[1])
+
+    def publish_local(self, collection: str, operation: str, doctor_id: str, doc_id: str,
+                      document: Optional[dict] = None):
+        event_id = f"{self._local_prefix}{next(self._local_ids)}"
+        self.publish(doctor_id, event_id, self.build_frame(event_id, collection, operation, doc_id, document))
+
+    def replay(self, doctor_id: str, last_event_id: str) -> Optional[list[tuple[str, bytes]]]:
+        """Events after last_event_id, or None when it is no longer (or never was) in the buffer"""
+        for position, (event_id, _, _) in enumerate(self._recent):
+            if event_id == last_event_id:
+                return [(e, frame) for e, owner, frame in list(self._recent)[position + 1:] if owner == doctor_id]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "streams": sum(len(queues) for queues in self._subscribers.values()),
+            "doctors": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "buffered": len(self._recent),
+            "source": "change_stream" if change_feed.available else "local",
+        }
+
+
+event_hub = EventHub()
+change_feed.subscribe(event_hub.on_change)
+
+
+async def notify_change(collection, operation: str, doctor_id: str, doc_id: str, document: Optional[dict] = None):
+    """Publish a write from a route handler when the change stream does not carry it.
+
+    The stream carries inserts and updates, and deletes only when the
+    collections have pre-images. Costs nothing unless the doctor has an open
+    event stream; updates then re-read the document so the event carries its
+    new state.
+    """
+    streamed = change_feed.available and (operation != "delete" or change_feed.pre_images)
+    if streamed or not event_hub.has_subscribers(doctor_id):
+        return
+    if operation == "update" and document is None:
+        document = await collection.find_one({"_id": ObjectId(doc_id), "doctor_id": doctor_id})
+        if document is None:
+            return
+    event_hub.publish_local(collection.name, operation, doctor_id, doc_id, document)
+
+
+async def catch_up(doctor_id: str, last_event_id: str) -> Optional[list[tuple[str, bytes]]]:
+    """Read missed events straight from the change stream, resuming after last_event_id"""
+    frames = []
+    try:
+        async with change_feed.watch({"_data": last_event_id}) as stream:
+            while len(frames) < EVENTS_REPLAY_SIZE:
+                change = await stream.try_next()
+                if change is None:
+                    return frames
+                built = event_hub.change_frame(change)
+                if built is not None and built[0] == doctor_id:
+                    frames.append((change["_id"]["_data"], built[1]))
+    except Exception as e:
+        logger.warning("Change stream catch-up failed: %s", e)
+    return None
+
+
+async def event_stream(doctor_id: str, last_event_id: Optional[str]) -> AsyncIterator[bytes]:
+    """SSE body: missed events first (or a reset), then live events with heartbeats"""
+    queue = event_hub.subscribe(doctor_id)
+    try:
+        yield b"retry: 3000\n\n"
+        seen = set()
+        if last_event_id:
+            missed = event_hub.replay(doctor_id, last_event_id)
+            # Another worker's event, or one that already left this worker's buffer; ids
+            # of locally published events ("<pid>-<n>") cannot be resumed from Mongo
+            if missed is None and change_feed.available and "-" not in last_event_id:
+                missed = await catch_up(doctor_id, last_event_id)
+            if missed is None:
+                yield RESET
+            else:
+                for event_id, frame in missed:
+                    seen.add(event_id)
+                    yield frame
+
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            if seen and frame.startswith(b"id: ") and frame[4:frame.index(b"\n")].decode() in seen:
+                continue
+            yield frame
+    finally:
+        event_hub.unsubscribe(doctor_id, queue)
@@ -0,0 +1,40 @@
+import csv
+import io
+import os
+
+from utils.pagination import SORT_ORDER
+
+# Documents per Mongo getMore and per chunk written to the client. The response
+# generator only pulls the next batch once the previous chunk has been sent, so
+# a slow client holds at most one batch in memory.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+PRESCRIPTION_CSV_COLUMNS = [
+    "prescription_id", "patient_id", "created_at", "updated_at", "symptoms", "notes", "follow_up_days",
+    "medicine_name", "dosage", "frequency", "duration",
+]
+
+
+def prescription_rows(doc: dict) -> list[list]:
+    """One CSV row per medicine, repeating the prescription columns"""
+    base = [str(doc["_id"]), doc.get("patient_id"), doc.get("created_at"), doc.get("updated_at"),
+            doc.get("symptoms"), doc.get("notes"), doc.get("follow_up_days")]
+    medicines = doc.get("medicines") or [{}]
+    return [base + [m.get("name"), m.get("dosage"), m.get("frequency"), m.get("duration")] for m in medicines]
+
+
+async def stream_csv(collection, query: dict, columns: list[str], rows, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield CSV bytes straight from the Motor cursor, one batch of documents at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    async for doc in collection.find(query).sort(SORT_ORDER).batch_size(batch_size):
+        writer.writerows(rows(doc))
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue().encode()
@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, create_model
+
+from utils.serialization import response_fields
+
+# Always read: created_at and _id build pagination cursors, updated_at and rev build ETags
+PROJECTION_ALWAYS = ("created_at", "updated_at", "rev")
+
+
+def parse_fields(fields: Optional[str], model: type[BaseModel]) -> Optional[tuple[str, ...]]:
+    """Validate ?fields=a,b against the response model; None means every field"""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    allowed = response_fields(model)
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}"
+        )
+    # Model order, so the same set always maps to the same cached model
+    return tuple(name for name in allowed if name in requested)
+
+
+@lru_cache(maxsize=256)
+def partial_model(model: type[BaseModel], fields: Optional[tuple[str, ...]]) -> type[BaseModel]:
+    """Response model restricted to fields, built once per field set"""
+    if fields is None:
+        return model
+    return create_model(
+        f"{model.__name__}Partial",
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in fields}
+    )
+
+
+def projection(fields: Optional[tuple[str, ...]]) -> Optional[dict]:
+    """Mongo projection for a field set, or None to read whole documents"""
+    if fields is None:
+        return None
+    return {name: 1 for name in (*fields, *PROJECTION_ALWAYS)}
+
+
+def select(body: dict, fields: Optional[tuple[str, ...]]) -> dict:
+    """Trim an already serialized full body (e.g. from the cache) to a field set"""
+    if fields is None:
+        return body
+    return {name: body.get(name) for name in fields}
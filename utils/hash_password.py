@@ -1,12 +1,73 @@
-from passlib.context import CryptContext
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", "2"))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "16"))
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "1"))
+
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """Create the password context on first use, so passlib and bcrypt load lazily.
+
+    Pinning min/max rounds to the configured cost makes passlib flag every
+    hash made with a different cost, so it gets rehashed on the next login.
+    """
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
+
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+_executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+# Running jobs plus jobs allowed to wait for a worker
+_slots = asyncio.Semaphore(HASH_POOL_SIZE + HASH_QUEUE_SIZE)
 
-# Create password context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+async def _run_in_pool(fn, *args):
+    """Run a hashing call in the worker pool, or reject with 503 when the queue is full"""
+    if _slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)},
+        )
+    async with _slots:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password in the bcrypt worker pool"""
+    return await _run_in_pool(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Verify a password in the bcrypt worker pool.
+
+    Returns (valid, new_hash); new_hash is set when the stored hash used a
+    different cost and should be replaced.
+    """
+    return await _run_in_pool(_verify_and_update, plain_password, hashed_password)
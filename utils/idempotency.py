@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from mongodb.connection import idempotency_collection
+from utils.jwt import SECRET_KEY
+from utils.serialization import dumps, json_response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# How long an unfinished claim (e.g. its worker died) blocks the key in other workers
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# (request fingerprint, status code, response body)
+Entry = tuple[str, int, dict]
+
+
+def fingerprint(payload: BaseModel) -> str:
+    """Keyed hash of the validated body, so a key reused for a different request is caught.
+
+    Keyed because register bodies carry the password and the hash is stored.
+    """
+    return hmac.new((SECRET_KEY or "").encode(), dumps(payload.model_dump(mode="json")), hashlib.sha256).hexdigest()
+
+
+class IdempotencyStore:
+    """Replays the first successful response for an Idempotency-Key.
+
+    Lookups go through a per-worker LRU, then the TTL-indexed idempotency
+    collection. Requests with the same key in this worker wait for the one
+    already running; in other workers they see its pending claim and get 409.
+    Failed requests release their claim, so a retry runs again.
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_SIZE, ttl: int = IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._responses: OrderedDict[str, tuple[float, Entry]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.cache_hits = 0
+        self.store_hits = 0
+        self.merged = 0
+        self.conflicts = 0
+
+    def _cached(self, key: str) -> Optional[Entry]:
+        cached = self._responses.get(key)
+        if cached is None:
+            return None
+        expires_at, entry = cached
+        if expires_at <= time.monotonic():
+            del self._responses[key]
+            return None
+        self._responses.move_to_end(key)
+        return entry
+
+    def _remember(self, key: str, entry: Entry):
+        self._responses[key] = (time.monotonic() + self.ttl, entry)
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_entries:
+            self._responses.popitem(last=False)
+
+    @staticmethod
+    def _replay(entry: Entry, digest: str):
+        stored_digest, status_code, body = entry
+        if stored_digest != digest:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request"
+            )
+        return json_response(body, status_code=status_code, headers={REPLAYED_HEADER: "true"})
+
+    async def _claim(self, key: str, digest: str) -> Optional[Entry]:
+        """Claim the key in Mongo; returns the stored entry instead when it already completed"""
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.now(timezone.utc)
+        claim = {"fingerprint": digest, "state": "pending", "expires_at": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}
+        try:
+            await idempotency_collection.insert_one({"_id": key, **claim})
+            return None
+        except DuplicateKeyError:
+            pass
+        stored = await idempotency_collection.find_one({"_id": key})
+        if stored is not None and stored["state"] == "done":
+            self.store_hits += 1
+            entry = (stored["fingerprint"], stored["status_code"], stored["body"])
+            self._remember(key, entry)
+            return entry
+        # Take over a claim whose request never finished; the TTL monitor only runs once a minute
+        try:
+            taken = await idempotency_collection.update_one(
+                {"_id": key, "state": "pending", "expires_at": {"$lt": now}}, {"$set": claim}, upsert=stored is None)
+            if taken.modified_count or taken.upserted_id is not None:
+                return None
+        except DuplicateKeyError:
+            pass
+        self.conflicts += 1
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"},
+        )
+
+    async def _execute(self, key: str, digest: str, handler: Callable[[], Awaitable[dict]],
+                       status_code: int) -> tuple[Entry, bool]:
+        """Run the handler under a claim; returns (entry, replayed)"""
+        stored = await self._claim(key, digest)
+        if stored is not None:
+            return stored, True
+        try:
+            body = await handler()
+        except Exception:
+            await idempotency_collection.delete_one({"_id": key, "state": "pending"})
+            raise
+        self.executed += 1
+        entry = (digest, status_code, body)
+        self._remember(key, entry)
+        try:
+            await idempotency_collection.update_one({"_id": key}, {"$set": {
+                "state": "done", "status_code": status_code, "body": body,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+            }})
+        except Exception as e:
+            # The write already happened; other workers see a pending claim until it expires
+            logger.warning("Storing idempotent response failed: %s", e)
+        return entry, False
+
+    async def run(self, idempotency_key: Optional[str], route: str, owner: Optional[str], payload: BaseModel,
+                  handler: Callable[[], Awaitable[dict]], status_code: int = status.HTTP_201_CREATED):
+        """Run handler once per (route, owner, key); later calls get the stored response"""
+        if idempotency_key is None:
+            return await handler()
+        if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+        key = hashlib.sha256(f"{route}\0{owner or ''}\0{idempotency_key}".encode()).hexdigest()
+        digest = fingerprint(payload)
+
+        entry = self._cached(key)
+        if entry is not None:
+            self.cache_hits += 1
+            return self._replay(entry, digest)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.merged += 1
+            await asyncio.wait([inflight])
+            if not inflight.cancelled():
+                # Raises the first request's error when it failed
+                return self._replay(inflight.result(), digest)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry, replayed = await self._execute(key, digest, handler, status_code)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; mark it retrieved so asyncio does not warn
+            future.exception()
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            self._inflight.pop(key, None)
+        return self._replay(entry, digest) if replayed else entry[2]
+
+    def stats(self) -> dict:
+        return {"size": len(self._responses), "inflight": len(self._inflight), "executed": self.executed,
+                "cache_hits": self.cache_hits, "store_hits": self.store_hits, "merged": self.merged,
+                "conflicts": self.conflicts}
+
+
+idempotency_store = IdempotencyStore()
@@ -1,18 +1,31 @@
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from functools import lru_cache
+import time
+import uuid
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+
+@lru_cache(maxsize=None)
+def _jose():
+    """Import python-jose on first use; it is one of the slowest imports at cold start"""
+    from jose import JWTError, jwt
+    return jwt, JWTError
+
 def create_access_token(data: dict):
+    jwt, _ = _jose()
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    issued_at = datetime.utcnow()
+    expire = issued_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # iat is whole seconds; iat_ms lets a sign-out tell apart tokens issued in the same second
+    to_encode.update({"exp": expire, "iat": issued_at, "iat_ms": int(time.time() * 1000), "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_access_token(token: str):
+    jwt, JWTError = _jose()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
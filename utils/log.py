@@ -0,0 +1,264 @@
+"""Structured JSON logging that never blocks the event loop.
+
+Records are put on a bounded queue by the request path and formatted,
+redacted and written in batches by a background thread. Configure with:
+
+    LOG_LEVEL=INFO                         root level
+    LOG_LEVELS=routes.doctor=DEBUG,...     per-logger levels
+    LOG_SAMPLE_RATE=1                      share of requests whose INFO/DEBUG records are kept
+    LOG_SAMPLE_RATES=/doctor/login=0.1     the same per route template
+    LOG_ACCESS=1                           one access line per request
+    LOG_QUEUE_SIZE=10000                   records held before new ones are dropped
+    LOG_FLUSH_SECONDS=0.05                 how often the writer thread wakes
+
+Warnings and errors are never sampled out.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+from logging.handlers import QueueHandler
+from typing import Optional
+
+from utils.serialization import dumps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "0.05"))
+LOG_ACCESS = os.getenv("LOG_ACCESS", "1") == "1"
+
+REQUEST_ID_HEADER = b"x-request-id"
+_VALID_REQUEST_ID = re.compile(r"^[\w.-]{1,64}$")
+
+# Keys whose values are never written, wherever they appear in a record
+SECRET_KEYS = re.compile(r"pass(word)?|secret|token|authorization|hash|api[_-]?key|credential", re.I)
+# Secrets that can hide inside free text
+SECRET_PATTERNS = [
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), "[REDACTED_JWT]"),
+    (re.compile(r"\$2[abxy]?\$\d{2}\$[./A-Za-z0-9]{53}"), "[REDACTED_HASH]"),
+    (re.compile(r"(?i)bearer\s+[\w.~+/=-]+"), "Bearer [REDACTED]"),
+]
+# One cheap scan decides whether a string needs the patterns above at all
+_MAY_HOLD_SECRET = re.compile(r"eyJ|\$2|bearer", re.I)
+REDACTED = "[REDACTED]"
+
+_request: ContextVar[Optional[dict]] = ContextVar("log_request", default=None)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+@lru_cache(maxsize=1024)
+def _is_secret_key(key: str) -> bool:
+    return SECRET_KEYS.search(key) is not None
+
+
+def redact(value):
+    if isinstance(value, str):
+        if _MAY_HOLD_SECRET.search(value):
+            for pattern, replacement in SECRET_PATTERNS:
+                value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, dict):
+        return {k: REDACTED if isinstance(k, str) and _is_secret_key(k) else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def current_request_id() -> Optional[str]:
+    context = _request.get()
+    return context["id"] if context else None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the writer thread"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = REDACTED if _is_secret_key(key) else redact(value)
+        if record.exc_info:
+            payload["exc"] = redact(self.formatException(record.exc_info))
+        return dumps(payload).decode()
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the request id and applies per-route sampling"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request.get()
+        if context is None:
+            return True
+        record.request_id = context["id"]
+        if record.levelno >= logging.WARNING:
+            return True
+        if context["sampled"] is None:
+            route = getattr(context["scope"].get("route"), "path", None)
+            sampled = random.random() < LOG_SAMPLE_RATES.get(route, LOG_SAMPLE_RATE)
+            if route is None:
+                # Not routed yet; decide again once the route is known
+                return sampled
+            context["sampled"] = sampled
+        return context["sampled"]
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread; drops them rather than wait when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting and redaction happen on the writer thread, not here
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(threading.Thread):
+    """Wakes every LOG_FLUSH_SECONDS and writes whatever is queued with a single write and flush.
+
+    Waking on an interval instead of blocking on get() keeps the request path
+    from handing the GIL to this thread on every record.
+    """
+
+    def __init__(self, log_queue: queue.Queue, stream, formatter: logging.Formatter):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self._stopping = threading.Event()
+
+    def drain(self):
+        lines = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if len(lines) % 32 == 31:
+                # Let the event loop in between; a long batch would otherwise hold the GIL for a whole switch interval
+                time.sleep(0)
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                lines.append(dumps({"level": "ERROR", "logger": "log", "message": "Unformattable log record",
+                                    "source": record.name}).decode())
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def run(self):
+        while not self._stopping.wait(LOG_FLUSH_SECONDS):
+            self.drain()
+        self.drain()
+
+    def stop(self):
+        """Write what is queued, then exit.
+
+        No timeout: the queue is bounded, and giving up while the thread is
+        mid-write to a slow stdout aborts the interpreter at shutdown.
+        """
+        self._stopping.set()
+        self.join()
+
+
+_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(stream=None) -> NonBlockingQueueHandler:
+    """Install the queue handler on the root logger and start the writer thread (once)"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(RequestContextFilter())
+
+    writer = LogWriter(log_queue, stream or sys.stdout, JsonFormatter())
+    writer.start()
+    atexit.register(writer.stop)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    return _handler
+
+
+def log_stats() -> dict:
+    return {"dropped": _handler.dropped if _handler else 0, "queued": _handler.queue.qsize() if _handler else 0}
+
+
+access_log = logging.getLogger("access")
+
+
+class RequestIdMiddleware:
+    """ASGI middleware giving every request an id (X-Request-ID in, or a new one) for its log records"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(REQUEST_ID_HEADER, b"").decode("latin-1")
+        if not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        token = _request.set({"id": request_id, "scope": scope, "sampled": None})
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER, request_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if LOG_ACCESS:
+                access_log.log(
+                    logging.WARNING if status_code >= 500 else logging.INFO, "request",
+                    extra={"method": scope["method"], "route": getattr(scope.get("route"), "path", None),
+                           "path": scope["path"], "status": status_code,
+                           "duration_ms": round((time.perf_counter() - started) * 1000, 2)},
+                )
+            _request.reset(token)
@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from typing import Optional
+
+from mongodb.change_stream import change_feed
+from mongodb.connection import prescription_collection
+
+logger = logging.getLogger(__name__)
+
+MEDICINE_INDEX_ON_STARTUP = os.getenv("MEDICINE_INDEX_ON_STARTUP", "1") == "1"
+# Full rebuilds correct drift and, without a change stream, pick up other workers' writes
+MEDICINE_INDEX_REFRESH_SECONDS = int(os.getenv("MEDICINE_INDEX_REFRESH_SECONDS", "3600"))
+MEDICINE_SUGGEST_LIMIT = 10
+
+
+def normalize(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+class MedicineIndex:
+    """Sorted array of normalized medicine names with per-doctor and clinic-wide counts.
+
+    A prefix is a bisect into the array, and every name sharing it sits in one
+    contiguous slice, so a suggestion costs O(log n + matches).
+    """
+
+    def __init__(self):
+        self._keys: list[str] = []
+        self._display: dict[str, str] = {}
+        self._counts: Counter = Counter()
+        self._doctor_counts: dict[str, Counter] = defaultdict(Counter)
+        self.loaded = False
+        self.rebuilt_at = None
+
+    def add(self, doctor_id: str, name: str, count: int = 1):
+        key = normalize(name)
+        if not key:
+            return
+        if key not in self._display:
+            insort(self._keys, key)
+            self._display[key] = " ".join(name.split())
+        self._counts[key] += count
+        self._doctor_counts[doctor_id][key] += count
+
+    def remove(self, doctor_id: str, name: str, count: int = 1):
+        key = normalize(name)
+        if key not in self._display:
+            return
+        mine = self._doctor_counts.get(doctor_id)
+        if mine is not None:
+            mine[key] -= count
+            if mine[key] <= 0:
+                del mine[key]
+        self._counts[key] -= count
+        if self._counts[key] <= 0:
+            del self._counts[key], self._display[key]
+            del self._keys[bisect_left(self._keys, key)]
+
+    @staticmethod
+    def _names(medicines: Optional[list]) -> list[str]:
+        names = (medicine.get("name") if isinstance(medicine, dict) else medicine.name for medicine in medicines or ())
+        return [name for name in names if name]
+
+    def add_prescription(self, doctor_id: str, medicines: Optional[list]):
+        for name in self._names(medicines):
+            self.add(doctor_id, name)
+
+    def remove_prescription(self, doctor_id: str, medicines: Optional[list]):
+        for name in self._names(medicines):
+            self.remove(doctor_id, name)
+
+    def suggest(self, doctor_id: str, prefix: str, limit: int = MEDICINE_SUGGEST_LIMIT) -> list[dict]:
+        """Names starting with prefix, the doctor's own most used first, then clinic-wide usage"""
+        prefix = normalize(prefix)
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + "\uffff", lo=start)
+        mine = self._doctor_counts.get(doctor_id, {})
+        best = heapq.nlargest(limit, self._keys[start:end], key=lambda k: (mine.get(k, 0), self._counts[k]))
+        return [{"name": self._display[k], "doctor_count": mine.get(k, 0), "count": self._counts[k]} for k in best]
+
+    def replace(self, other: "MedicineIndex"):
+        self._keys, self._display = other._keys, other._display
+        self._counts, self._doctor_counts = other._counts, other._doctor_counts
+        self.loaded = True
+        self.rebuilt_at = other.rebuilt_at
+
+    def on_change(self, change: dict):
+        operation = change["operationType"]
+        if change["ns"]["coll"] != "prescription" or operation not in ("insert", "update", "replace", "delete"):
+            return
+        document = change.get("fullDocument") or {}
+        if operation == "insert":
+            self.add_prescription(document.get("doctor_id"), document.get("medicines"))
+            return
+        # Updates and deletes need the old list; without pre-images the route that made them records them
+        before = change.get("fullDocumentBeforeChange")
+        fields = (change.get("updateDescription") or {}).get("updatedFields", {})
+        # Pipeline updates may report array changes as dotted paths such as medicines.0.name
+        touched = any(field.split(".", 1)[0] == "medicines" for field in fields)
+        if before is None or (operation == "update" and not touched):
+            return
+        self.remove_prescription(before.get("doctor_id"), before.get("medicines"))
+        if operation != "delete":
+            self.add_prescription(document.get("doctor_id"), document.get("medicines"))
+
+    def stats(self) -> dict:
+        return {"names": len(self._keys), "doctors": len(self._doctor_counts), "loaded": self.loaded,
+                "rebuilt_at": self.rebuilt_at}
+
+
+medicine_index = MedicineIndex()
+change_feed.subscribe(medicine_index.on_change)
+
+
+async def build_medicine_index():
+    """Count (doctor, medicine) pairs server side and swap in a fresh index"""
+    fresh = MedicineIndex()
+    pipeline = [
+        {"$unwind": "$medicines"},
+        {"$group": {"_id": {"doctor_id": "$doctor_id", "name": "$medicines.name"}, "count": {"$sum": 1}}},
+    ]
+    async for row in prescription_collection.aggregate(pipeline, allowDiskUse=True):
+        if row["_id"].get("name"):
+            fresh.add(row["_id"].get("doctor_id"), row["_id"]["name"], row["count"])
+    fresh.rebuilt_at = int(time.time())
+    medicine_index.replace(fresh)
+
+
+def record_medicines(doctor_id: str, medicines: Optional[list], previous: Optional[list] = None):
+    """Route hook for written prescriptions: medicines is the new list (None on delete),
+    previous the one it replaced (None on insert).
+
+    The change feed covers inserts whenever it runs, and updates and deletes
+    when it carries pre-images.
+    """
+    if change_feed.available and (previous is None or change_feed.pre_images):
+        return
+    medicine_index.remove_prescription(doctor_id, previous)
+    medicine_index.add_prescription(doctor_id, medicines)
+
+
+async def medicine_index_loop():
+    while True:
+        try:
+            await build_medicine_index()
+        except Exception as e:
+            logger.warning("Medicine index build failed: %s", e)
+        await asyncio.sleep(MEDICINE_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,237 @@
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+# Log requests slower than this (milliseconds) with the Mongo commands they issued; 0 disables it
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+# Share of Mongo replies whose size is measured. Measuring re-encodes the whole reply
+# (a find batch can hold 1000 documents), so it is off unless asked for.
+MONGO_REPLY_SIZE_SAMPLE_RATE = float(os.getenv("MONGO_REPLY_SIZE_SAMPLE_RATE", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Mongo commands issued while serving the current request (set by MetricsMiddleware)
+_request_commands: ContextVar[Optional[list]] = ContextVar("request_commands", default=None)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        for line in super().render():
+            yield line.replace(" counter", " gauge", 1) if line.startswith("# TYPE") else line
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._counts = {}
+        self._sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value: float):
+        with self._lock:
+            counts = self._counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._sums[label_values] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {self._sums[label_values]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_requests_total = Counter("http_requests_total", "HTTP requests by status", ("method", "route", "status"))
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served", ("method",))
+mongo_command_duration = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_reply_size = Histogram("mongo_reply_size_bytes", "MongoDB reply size (sampled replies only)", ("collection", "command"), SIZE_BUCKETS)
+mongo_command_failures = Counter("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+mongo_pool_checkout_wait = Histogram("mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+mongo_pool_connections = Gauge("mongo_pool_connections", "Open pooled connections by state", ("state",))
+
+
+def pool_connection_counts() -> dict:
+    """Current open and checked-out connection counts from the pool listener"""
+    values = mongo_pool_connections._values
+    return {"open_connections": int(values.get(("open",), 0)),
+            "checked_out_connections": int(values.get(("checked_out",), 0))}
+
+
+REGISTRY = [
+    http_request_duration, http_requests_total, http_requests_in_flight,
+    mongo_command_duration, mongo_reply_size, mongo_command_failures,
+    mongo_pool_checkout_wait, mongo_pool_connections,
+]
+
+
+def render_metrics(extra_gauges: Optional[dict] = None) -> str:
+    """Prometheus text exposition of every registered metric, plus flat gauges"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class CommandMetrics:
+    """Per-collection, per-command durations and (sampled) reply sizes"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        # getMore names the cursor id there and the collection in its own field
+        key = "collection" if event.command_name == "getMore" else event.command_name
+        value = event.command.get(key)
+        self._collections[event.request_id] = value if isinstance(value, str) else "-"
+
+    def _finish(self, event, failed: bool):
+        collection = self._collections.pop(event.request_id, "-")
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe(collection, event.command_name, value=seconds)
+        if failed:
+            mongo_command_failures.inc(collection, event.command_name)
+        elif MONGO_REPLY_SIZE_SAMPLE_RATE and random.random() < MONGO_REPLY_SIZE_SAMPLE_RATE:
+            mongo_reply_size.observe(collection, event.command_name, value=len(bson.encode(event.reply)))
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.append((collection, event.command_name, seconds * 1000))
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class PoolMetrics:
+    """Connection pool checkout waits and connection counts"""
+
+    def connection_checked_out(self, event):
+        if event.duration is not None:
+            mongo_pool_checkout_wait.observe(value=event.duration)
+        mongo_pool_connections.inc("checked_out")
+
+    def connection_checked_in(self, event):
+        mongo_pool_connections.dec("checked_out")
+
+    def connection_check_out_failed(self, event):
+        if getattr(event, "duration", None) is not None:
+            mongo_pool_checkout_wait.observe(value=event.duration)
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc("open")
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec("open")
+
+    def connection_check_out_started(self, event): pass
+    def connection_ready(self, event): pass
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+
+
+def event_listeners() -> list:
+    """Command and pool listeners for a new client.
+
+    pymongo only accepts subclasses of its listener types; they are derived here,
+    when the client is built, so importing the app does not load the driver.
+    """
+    from pymongo import monitoring
+
+    return [type("CommandMetricsListener", (CommandMetrics, monitoring.CommandListener), {})(),
+            type("PoolMetricsListener", (PoolMetrics, monitoring.ConnectionPoolListener), {})()]
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, in-flight requests and status codes"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status_code = 500
+        commands = [] if SLOW_REQUEST_MS else None
+        token = _request_commands.set(commands)
+        http_requests_in_flight.inc(method)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec(method)
+            # Routing stores the matched route on the scope; use its template to keep labels bounded
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(method, route_path, value=elapsed)
+            http_requests_total.inc(method, route_path, str(status_code))
+            _request_commands.reset(token)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning("Slow request", extra={
+                    "method": method, "route": route_path, "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "mongo": [{"command": f"{c}.{n}", "ms": round(ms, 1)} for c, n, ms in commands],
+                })
@@ -0,0 +1,109 @@
+import os
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from mongodb.change_stream import change_feed
+from mongodb.connection import patient_collection
+
+OWNERSHIP_MAX_DOCTORS = int(os.getenv("OWNERSHIP_MAX_DOCTORS", "1000"))
+# Without a change stream other workers' deletes are only seen after a reload
+OWNERSHIP_TTL_SECONDS = int(os.getenv("OWNERSHIP_TTL_SECONDS", "60"))
+
+
+class OwnershipIndex:
+    """Per-worker LRU of doctor_id -> ids of that doctor's patients.
+
+    A doctor's set is loaded with one query on first use. create/delete hooks
+    keep it current in this worker, and the change feed keeps it current
+    across workers. A miss is always confirmed against Mongo, so a patient
+    created by another worker is never rejected.
+    """
+
+    def __init__(self, max_doctors: int = OWNERSHIP_MAX_DOCTORS, ttl: int = OWNERSHIP_TTL_SECONDS):
+        self.max_doctors = max_doctors
+        self.ttl = ttl
+        self._doctors: OrderedDict[str, tuple[float, set[str]]] = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.fallbacks = 0
+        self.evictions = 0
+
+    def _patients(self, doctor_id: str):
+        entry = self._doctors.get(doctor_id)
+        if entry is None:
+            return None
+        loaded_at, patients = entry
+        # A live change stream keeps the set current, so it never goes stale
+        if not change_feed.available and time.monotonic() - loaded_at > self.ttl:
+            del self._doctors[doctor_id]
+            return None
+        self._doctors.move_to_end(doctor_id)
+        return patients
+
+    async def _load(self, doctor_id: str) -> set[str]:
+        self.loads += 1
+        patients = {str(doc["_id"]) async for doc in patient_collection.find({"doctor_id": doctor_id}, {"_id": 1})}
+        self._doctors[doctor_id] = (time.monotonic(), patients)
+        while len(self._doctors) > self.max_doctors:
+            self._doctors.popitem(last=False)
+            self.evictions += 1
+        return patients
+
+    async def owns(self, doctor_id: str, patient_id: str) -> bool:
+        if not ObjectId.is_valid(patient_id):
+            return False
+        patients = self._patients(doctor_id)
+        if patients is None:
+            patients = await self._load(doctor_id)
+        if patient_id in patients:
+            self.hits += 1
+            return True
+
+        self.fallbacks += 1
+        if await patient_collection.find_one({"_id": ObjectId(patient_id), "doctor_id": doctor_id}, {"_id": 1}):
+            patients.add(patient_id)
+            return True
+        return False
+
+    def add(self, doctor_id: str, patient_id: str):
+        patients = self._patients(doctor_id)
+        if patients is not None:
+            patients.add(patient_id)
+
+    def discard(self, patient_id: str, doctor_id: str = None):
+        """Forget a deleted patient; delete events carry no doctor_id, so scan every set then"""
+        if doctor_id is not None:
+            entries = [self._doctors[doctor_id]] if doctor_id in self._doctors else []
+        else:
+            entries = self._doctors.values()
+        for _, patients in entries:
+            patients.discard(patient_id)
+
+    def clear(self):
+        self._doctors.clear()
+
+    def on_change(self, change: dict):
+        if change["ns"]["coll"] != "patient":
+            return
+        patient_id = str(change["documentKey"]["_id"])
+        if change["operationType"] == "insert":
+            self.add(change["fullDocument"]["doctor_id"], patient_id)
+        elif change["operationType"] == "delete":
+            self.discard(patient_id)
+
+    def stats(self) -> dict:
+        return {
+            "doctors": len(self._doctors),
+            "patients": sum(len(patients) for _, patients in self._doctors.values()),
+            "hits": self.hits,
+            "loads": self.loads,
+            "fallbacks": self.fallbacks,
+            "evictions": self.evictions,
+            "change_stream": change_feed.available,
+        }
+
+
+ownership_index = OwnershipIndex()
+change_feed.subscribe(ownership_index.on_change, on_reset=ownership_index.clear)
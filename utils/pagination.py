@@ -0,0 +1,106 @@
+import base64
+import json
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from utils.conditional import is_not_modified, not_modified, page_etag
+from utils.fields import parse_fields, partial_model, projection
+from utils.serialization import dumps, json_response, serialize_document, serialize_documents
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 200
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Keyset order used by every /all listing
+SORT_ORDER = [("created_at", 1), ("_id", 1)]
+NEWEST_FIRST = [("created_at", -1), ("_id", -1)]
+
+
+def encode_cursor(doc: dict) -> str:
+    """Build an opaque cursor pointing just after the given document"""
+    raw = json.dumps([doc.get("created_at", 0), str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, ObjectId]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(created_at), ObjectId(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query: dict, cursor: Optional[str], descending: bool = False) -> dict:
+    """Restrict a query to documents after the cursor in (created_at, _id) order"""
+    if not cursor:
+        return query
+    created_at, doc_id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {
+        **query,
+        "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "_id": {op: doc_id}},
+        ],
+    }
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+async def fetch_page(collection, query: dict, limit: int, cursor: Optional[str] = None,
+                     projection: Optional[dict] = None):
+    """Return one page of documents and the cursor for the next page (or None)"""
+    docs = await collection.find(keyset_query(query, cursor), projection).sort(SORT_ORDER).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1])
+    return docs, None
+
+
+async def stream_ndjson(collection, query: dict, serialize, cursor: Optional[str] = None, limit: Optional[int] = None,
+                       projection: Optional[dict] = None, batch_size: int = STREAM_BATCH_SIZE):
+    """Yield documents as NDJSON lines straight from the Motor cursor, one batch at a time"""
+    mongo_cursor = collection.find(keyset_query(query, cursor), projection).sort(SORT_ORDER).batch_size(batch_size)
+    if limit:
+        mongo_cursor = mongo_cursor.limit(limit)
+    lines = []
+    async for doc in mongo_cursor:
+        lines.append(dumps(serialize(doc)))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def list_response(collection, query: dict, model: type[BaseModel], limit: Optional[int], cursor: Optional[str],
+                        fields: Optional[str], accept: Optional[str], accept_encoding: Optional[str],
+                        if_none_match: Optional[str]) -> Response:
+    """Body of every /all route: one keyset page (next page in X-Next-Cursor) or an NDJSON stream"""
+    selected = parse_fields(fields, model)
+    shape = partial_model(model, selected)
+
+    if wants_ndjson(accept):
+        # Stream every matching document without buffering the whole list; no validator,
+        # since it would only be known once the last document has been sent
+        return StreamingResponse(
+            stream_ndjson(collection, query, lambda d: serialize_document(d, shape), cursor, limit, projection(selected)),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+
+    docs, next_cursor = await fetch_page(collection, query, limit or DEFAULT_PAGE_LIMIT, cursor, projection(selected))
+    headers = {"ETag": page_etag(collection.name, docs, next_cursor, selected)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if is_not_modified(headers["ETag"], None, if_none_match, None):
+        return not_modified(headers)
+    return json_response(serialize_documents(docs, shape), accept_encoding, headers=headers)
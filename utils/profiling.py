@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Write an import-time and initialization breakdown on startup
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_PATH = os.getenv("STARTUP_PROFILE_PATH", "/tmp/startup_profile.json")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_breakdown(module: str = "main", top: int = 30) -> dict:
+    """Run `python -X importtime -c 'import <module>'` in a fresh interpreter and summarize it"""
+    env = {**os.environ, "STARTUP_PROFILE": "0"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    total = next((r["cumulative_ms"] for r in rows if r["module"] == module and r["depth"] == 0), None)
+    # Direct imports of the module are what the app controls: which of them it imports, and when
+    packages = sorted((r for r in rows if r["depth"] == 1), key=lambda r: r["cumulative_ms"], reverse=True)
+    slowest = sorted(rows, key=lambda r: r["self_ms"], reverse=True)
+    return {
+        "module": module,
+        "total_ms": total,
+        "returncode": result.returncode,
+        "top_level": packages[:top],
+        "slowest_self": slowest[:top],
+    }
+
+
+def model_build_times() -> dict:
+    """Time a forced schema rebuild of every Pydantic model in the model package"""
+    import importlib
+    import pkgutil
+
+    from pydantic import BaseModel
+
+    import model
+
+    timings = {}
+    for info in pkgutil.iter_modules(model.__path__):
+        module = importlib.import_module(f"model.{info.name}")
+        for name, value in vars(module).items():
+            if isinstance(value, type) and issubclass(value, BaseModel) and value.__module__ == module.__name__:
+                started = time.perf_counter()
+                value.model_rebuild(force=True)
+                timings[f"{module.__name__}.{name}"] = (time.perf_counter() - started) * 1000
+    return dict(sorted(timings.items(), key=lambda item: item[1], reverse=True))
+
+
+def openapi_build_ms(app) -> float:
+    """Time building the OpenAPI schema, which FastAPI otherwise does on the first /docs hit"""
+    app.openapi_schema = None
+    started = time.perf_counter()
+    app.openapi()
+    return (time.perf_counter() - started) * 1000
+
+
+def write_startup_profile(app, phases: dict, path: str = STARTUP_PROFILE_PATH) -> dict:
+    """Collect the breakdown and write it as JSON"""
+    profile = {
+        "phases_ms": phases,
+        "imports": import_breakdown("main"),
+        "models_ms": model_build_times(),
+        "openapi_ms": openapi_build_ms(app),
+    }
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    top = ", ".join(f"{r['module']} {r['cumulative_ms']:.0f}ms" for r in profile["imports"]["top_level"][:5])
+    logger.info("Startup profile written to %s: import main %sms (%s)", path, profile["imports"]["total_ms"], top)
+    return profile
@@ -0,0 +1,72 @@
+import gzip
+import os
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+    import json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Documents read back from Mongo were validated when they were written
+TRUST_DB_READS = os.getenv("TRUST_DB_READS", "1") == "1"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+
+def dumps(content) -> bytes:
+    """Encode to JSON bytes with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(content, default=str)
+    return json.dumps(content, default=str, separators=(",", ":")).encode()
+
+
+@lru_cache(maxsize=None)
+def response_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(model.model_fields)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def serialize_document(doc: dict, model: type[BaseModel]) -> dict:
+    """Shape one Mongo document like the response model"""
+    if TRUST_DB_READS:
+        return {field: doc.get(field) for field in response_fields(model)}
+    return model.model_validate(doc).model_dump(mode="json")
+
+
+def serialize_documents(docs: list[dict], model: type[BaseModel]) -> list[dict]:
+    """Shape a list of Mongo documents like the response model, validating at most once"""
+    if TRUST_DB_READS:
+        fields = response_fields(model)
+        return [{field: doc.get(field) for field in fields} for doc in docs]
+    adapter = list_adapter(model)
+    return adapter.dump_python(adapter.validate_python(docs), mode="json")
+
+
+def json_response(content, accept_encoding: Optional[str] = None, status_code: int = 200,
+                  headers: Optional[dict] = None) -> Response:
+    """Build a JSON response, compressed with brotli or gzip when it is large enough"""
+    body = dumps(content)
+    headers = dict(headers or {})
+    if len(body) >= COMPRESSION_MIN_BYTES and accept_encoding:
+        if brotli is not None and "br" in accept_encoding:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accept_encoding:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        if "Content-Encoding" in headers:
+            headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
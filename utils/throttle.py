@@ -0,0 +1,178 @@
+import math
+import os
+import time
+from collections import OrderedDict, defaultdict
+
+from fastapi import HTTPException, Request, status
+
+# Token buckets: capacity attempts, refilled evenly over a minute
+LOGIN_EMAIL_PER_MINUTE = int(os.getenv("LOGIN_EMAIL_PER_MINUTE", "5"))
+LOGIN_IP_PER_MINUTE = int(os.getenv("LOGIN_IP_PER_MINUTE", "30"))
+# Lockout after a failed attempt: base * 2^(failures - 1) seconds, capped
+LOGIN_BACKOFF_BASE_SECONDS = float(os.getenv("LOGIN_BACKOFF_BASE_SECONDS", "1"))
+LOGIN_BACKOFF_MAX_SECONDS = float(os.getenv("LOGIN_BACKOFF_MAX_SECONDS", "300"))
+# A key's failure count is forgotten this long after its last failure
+LOGIN_FAILURE_TTL_SECONDS = LOGIN_BACKOFF_MAX_SECONDS * 2
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+# Use X-Forwarded-For for the client IP (only behind a proxy that sets it)
+LOGIN_TRUST_FORWARDED = os.getenv("LOGIN_TRUST_FORWARDED", "0") == "1"
+# Set to share buckets and lockouts between workers through Redis
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL")
+
+
+def backoff_seconds(failures: int) -> float:
+    return min(LOGIN_BACKOFF_MAX_SECONDS, LOGIN_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+
+
+class MemoryThrottleBackend:
+    """In-process token buckets and failure lockouts, bounded by an LRU over keys"""
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        # key -> (failures, blocked until, forgotten at)
+        self._failures: OrderedDict[str, tuple[int, float, float]] = OrderedDict()
+
+    def _store(self, entries: OrderedDict, key: str, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+    async def take(self, key: str, capacity: int, per_seconds: float) -> float:
+        """Take one token; returns 0 when allowed, else seconds until a token is available"""
+        now = time.monotonic()
+        rate = capacity / per_seconds
+        tokens, last = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._store(self._buckets, key, (tokens, now))
+        return wait
+
+    async def blocked_for(self, key: str) -> float:
+        _, until, _ = self._failures.get(key, (0, 0.0, 0.0))
+        return max(0.0, until - time.monotonic())
+
+    async def record_failure(self, key: str) -> float:
+        now = time.monotonic()
+        failures, _, expires_at = self._failures.get(key, (0, 0.0, 0.0))
+        if expires_at <= now:
+            # Same window as the Redis backend's EXPIRE on the failure counter
+            failures = 0
+        delay = backoff_seconds(failures + 1)
+        self._store(self._failures, key, (failures + 1, now + delay, now + LOGIN_FAILURE_TTL_SECONDS))
+        return delay
+
+    async def reset(self, key: str):
+        self._failures.pop(key, None)
+
+
+class RedisThrottleBackend:
+    """Same buckets and lockouts shared by every worker"""
+
+    # Refill and take atomically; state is a hash of tokens and last refill time
+    TAKE = """
+    local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or capacity)
+    local last = tonumber(redis.call('HGET', KEYS[1], 'ts') or now)
+    tokens = math.min(capacity, tokens + (now - last) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._take = self._redis.register_script(self.TAKE)
+
+    async def take(self, key: str, capacity: int, per_seconds: float) -> float:
+        return float(await self._take(keys=[f"throttle:bucket:{key}"], args=[capacity, capacity / per_seconds, time.time()]))
+
+    async def blocked_for(self, key: str) -> float:
+        remaining_ms = await self._redis.pttl(f"throttle:block:{key}")
+        return max(0.0, remaining_ms / 1000)
+
+    async def record_failure(self, key: str) -> float:
+        failures = await self._redis.incr(f"throttle:fail:{key}")
+        delay = backoff_seconds(failures)
+        await self._redis.expire(f"throttle:fail:{key}", int(LOGIN_FAILURE_TTL_SECONDS))
+        await self._redis.set(f"throttle:block:{key}", 1, px=max(1, int(delay * 1000)))
+        return delay
+
+    async def reset(self, key: str):
+        await self._redis.delete(f"throttle:fail:{key}", f"throttle:block:{key}")
+
+
+def client_ip(request: Request) -> str:
+    if LOGIN_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class LoginThrottle:
+    """Per-email and per-IP token buckets plus exponential lockout after failures.
+
+    Lockouts are keyed by (email, IP), so guessing at someone's password from
+    one address does not lock the owner out everywhere; the per-email bucket
+    still caps the total guess rate across addresses.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.allowed = 0
+        self.throttled = defaultdict(int)
+        self.failures = 0
+
+    def _reject(self, reason: str, wait: float):
+        self.throttled[reason] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please retry later",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+    async def check(self, email: str, ip: str):
+        """Raise 429 before any lookup or hashing when the attempt is over a limit"""
+        wait = await self.backend.blocked_for(f"fail:{email}:{ip}")
+        if wait:
+            self._reject("backoff", wait)
+        wait = await self.backend.take(f"ip:{ip}", LOGIN_IP_PER_MINUTE, 60)
+        if wait:
+            self._reject("ip", wait)
+        wait = await self.backend.take(f"email:{email}", LOGIN_EMAIL_PER_MINUTE, 60)
+        if wait:
+            self._reject("email", wait)
+        self.allowed += 1
+
+    async def failed(self, email: str, ip: str):
+        self.failures += 1
+        await self.backend.record_failure(f"fail:{email}:{ip}")
+
+    async def succeeded(self, email: str, ip: str):
+        await self.backend.reset(f"fail:{email}:{ip}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "allowed": self.allowed,
+            "failures": self.failures,
+            "throttled": sum(self.throttled.values()),
+            "throttled_backoff": self.throttled["backoff"],
+            "throttled_ip": self.throttled["ip"],
+            "throttled_email": self.throttled["email"],
+        }
+
+
+login_throttle = LoginThrottle(
+    RedisThrottleBackend(LOGIN_THROTTLE_REDIS_URL) if LOGIN_THROTTLE_REDIS_URL else MemoryThrottleBackend()
+)
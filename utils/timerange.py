@@ -0,0 +1,16 @@
+from typing import Optional
+
+# created_at, updated_at and follow_up_due_at are Unix seconds
+DAY_SECONDS = 86400
+
+
+def created_between(query: dict, date_from: Optional[int], date_to: Optional[int]) -> dict:
+    """Add the inclusive ?from=&to= created_at range to query; either end may be open"""
+    bounds = {}
+    if date_from is not None:
+        bounds["$gte"] = date_from
+    if date_to is not None:
+        bounds["$lte"] = date_to
+    if bounds:
+        query["created_at"] = bounds
+    return query
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from mongodb.connection import revoked_token_collection
+from utils.jwt import ACCESS_TOKEN_EXPIRE_MINUTES, verify_access_token
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Back the revocation list with Mongo so every worker sees logouts
+TOKEN_REVOCATION_MONGO = os.getenv("TOKEN_REVOCATION_MONGO", "1") == "1"
+TOKEN_REVOCATION_SYNC_SECONDS = int(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", "30"))
+
+
+def token_key(token: str) -> str:
+    """Cache and revocation key for a token, so raw tokens are never stored"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU of verified JWT claims with an in-memory revocation list"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # token key -> exp, doctor_id -> revoked-before timestamp in milliseconds
+        self._revoked_tokens: dict[str, int] = {}
+        self._revoked_doctors: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.evictions = 0
+        self.decode_seconds = 0.0
+
+    def _is_revoked(self, key: str, claims: dict) -> bool:
+        if key in self._revoked_tokens:
+            return True
+        revoked_before = self._revoked_doctors.get(claims.get("doctor_id"))
+        if revoked_before is None:
+            return False
+        # Tokens issued before iat_ms existed count from the start of their second
+        return claims.get("iat_ms", claims.get("iat", 0) * 1000) <= revoked_before
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Return the token's claims, from cache when possible, or None if invalid or revoked"""
+        key = token_key(token)
+        now = time.time()
+        claims = self._entries.get(key)
+        if claims is not None and claims["exp"] > now:
+            self._entries.move_to_end(key)
+            if self._is_revoked(key, claims):
+                self.rejected += 1
+                return None
+            self.hits += 1
+            return claims
+
+        self.misses += 1
+        started = time.perf_counter()
+        claims = verify_access_token(token)
+        self.decode_seconds += time.perf_counter() - started
+        if claims is None or self._is_revoked(key, claims):
+            self._entries.pop(key, None)
+            return None
+
+        self._entries[key] = claims
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return claims
+
+    def revoke_token(self, token_hash: str, exp: int):
+        self._revoked_tokens[token_hash] = exp
+        self._entries.pop(token_hash, None)
+
+    def revoke_doctor(self, doctor_id: str, revoked_before_ms: int):
+        self._revoked_doctors[doctor_id] = max(revoked_before_ms, self._revoked_doctors.get(doctor_id, 0))
+
+    def prune_revocations(self):
+        """Forget revocations for tokens that have expired anyway"""
+        now = time.time()
+        self._revoked_tokens = {k: exp for k, exp in self._revoked_tokens.items() if exp > now}
+        oldest_live_token_ms = (now - ACCESS_TOKEN_EXPIRE_MINUTES * 60) * 1000
+        self._revoked_doctors = {k: t for k, t in self._revoked_doctors.items() if t >= oldest_live_token_ms}
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        avg_decode = self.decode_seconds / self.misses if self.misses else 0.0
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "avg_decode_ms": avg_decode * 1000,
+            "decode_ms_saved": self.hits * avg_decode * 1000,
+        }
+
+
+token_cache = TokenCache()
+
+
+async def revoke(token: str, claims: dict):
+    """Revoke one token (logout)"""
+    key = token_key(token)
+    token_cache.revoke_token(key, int(claims["exp"]))
+    if TOKEN_REVOCATION_MONGO:
+        await revoked_token_collection.update_one(
+            {"_id": key},
+            {"$set": {"expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)}},
+            upsert=True
+        )
+
+
+async def revoke_all_for_doctor(doctor_id: str):
+    """Revoke every token issued to a doctor so far (forced sign-out)"""
+    now = time.time()
+    now_ms = int(now * 1000)
+    token_cache.revoke_doctor(doctor_id, now_ms)
+    if TOKEN_REVOCATION_MONGO:
+        await revoked_token_collection.update_one(
+            {"_id": f"doctor:{doctor_id}"},
+            {"$set": {
+                "doctor_id": doctor_id,
+                "revoked_before_ms": now_ms,
+                "expires_at": datetime.fromtimestamp(now + ACCESS_TOKEN_EXPIRE_MINUTES * 60, timezone.utc),
+            }},
+            upsert=True
+        )
+
+
+async def sync_revocations():
+    """Load revocations written by other workers into the in-memory list"""
+    async for doc in revoked_token_collection.find({}):
+        expires_at = doc["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        if "doctor_id" in doc:
+            # Documents written before revoked_before_ms cover their whole second
+            revoked_before_ms = doc.get("revoked_before_ms", doc.get("revoked_before", 0) * 1000 + 999)
+            token_cache.revoke_doctor(doc["doctor_id"], revoked_before_ms)
+        else:
+            token_cache.revoke_token(doc["_id"], int(expires_at))
+    token_cache.prune_revocations()
+
+
+async def revocation_sync_loop():
+    while True:
+        try:
+            await sync_revocations()
+        except Exception as e:
+            logger.warning("Token revocation sync failed: %s", e)
+        await asyncio.sleep(TOKEN_REVOCATION_SYNC_SECONDS)